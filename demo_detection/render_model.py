@@ -21,6 +21,8 @@ parser.add_argument('-d', '--distance', default='2.0')
 parser.add_argument('-o', '--output_img', help='Output img filename.', default=osp.join(BASE_DIR, 'demo_img.png'))
 parser.add_argument('-l', '--output_label', help='Output label filename.', default=osp.join(BASE_DIR, 'demo_label.txt'))
 parser.add_argument('-s', '--scale', help='Scale factor if model not in metres.', default=0.001)
+parser.add_argument('--visibility', help='Keypoint occlusion test (raycast or zbuffer).', default='raycast')
+parser.add_argument('--depth_threshold', help='Relative depth tolerance of the zbuffer test.', default=0.01)
 args = parser.parse_args()
 
 blank_file = osp.join(g_blank_blend_file_path)
@@ -34,7 +36,7 @@ view_fout.write(' '.join([args.azimuth, args.elevation, args.tilt, args.distance
 view_fout.close()
 
 try:
-    render_cmd = '%s %s --background --python %s -- %s %s %s %s %s %s' % (g_blender_executable_path, blank_file, render_code, args.model_file, args.keypoint_file, 'xxx', view_file, temp_dirname, args.scale)
+    render_cmd = '%s %s --background --python %s -- %s %s %s %s %s %s --visibility %s --depth_threshold %s' % (g_blender_executable_path, blank_file, render_code, args.model_file, args.keypoint_file, 'xxx', view_file, temp_dirname, args.scale, args.visibility, args.depth_threshold)
     print render_cmd
     os.system(render_cmd)
     #imgs = glob.glob(temp_dirname+'/*.png')
@@ -4,26 +4,42 @@ import os.path as osp
 import sys
 import argparse
 import os, tempfile, glob, shutil
+import time, datetime
+import multiprocessing
+from multiprocessing.dummy import Pool
+from subprocess import call
 import numpy as np
 
 BASE_DIR = osp.dirname(__file__)
 sys.path.append(osp.join(BASE_DIR,'../'))
+sys.path.append(osp.join(BASE_DIR,'../render_pipeline'))
 from global_variables import *
+from keypoint_store import *
 
 parser = argparse.ArgumentParser(description='Render Model Images of a certain class and view')
 parser.add_argument('model_file', help='CAD Model obj filename', default=osp.join(BASE_DIR,'sample_model/model.obj'))
 parser.add_argument('keypoint_file', help='Chosen Keypoint list file')
 parser.add_argument('output_folder', help='output folder')
 parser.add_argument('-s', '--scale', help='Scale factor if model not in metres.', default=0.001)
+parser.add_argument('--visibility', help='Keypoint occlusion test (raycast or zbuffer).', default='raycast')
+parser.add_argument('--depth_threshold', help='Relative depth tolerance of the zbuffer test.', default=0.01)
+parser.add_argument('--lod', help='Render decimated meshes for views where the model looks small.', action='store_true')
+parser.add_argument('--label_store', help='Save all labels to output_folder/labels.npz instead of one txt file per image.', action='store_true')
 parser.add_argument('-n', '--num_renders', help='Number of instances at each distance', default=1500, type=int)
+parser.add_argument('-j', '--jobs', help='Number of blender processes running at the same time.', default=multiprocessing.cpu_count(), type=int)
+parser.add_argument('--shards', help='Number of parts the views are split into, 4 per job by default.', default=None, type=int)
+parser.add_argument('--seed', help='Random seed of views and lighting, same seed gives the same outputs.', default=None, type=int)
 args = parser.parse_args()
+if args.lod and args.visibility == 'zbuffer':
+    parser.error('--lod can not be used with --visibility zbuffer')
 
+if args.seed is not None:
+    np.random.seed(args.seed)
 temp_dirname = tempfile.mkdtemp()
-view_file = osp.join(temp_dirname, 'view.txt')
-view_fout = open(view_file,'w')
 blank_file = osp.join(g_blank_blend_file_path)
 render_code = osp.join(g_render4cnn_root_folder, 'render_pipeline/render_model.py')
 
+view_lines = []
 distances = [1, 1.25, 1.5, 1.75, 2, 2.4, 2.8, 3.2, 4, 5, 6, 8]
 for d in distances:
     for i in xrange(args.num_renders):
@@ -34,7 +50,49 @@ for d in distances:
         img_file = osp.join(args.output_folder, 'images', 'syn_a%03d_e%03d_t%03d_d%04d.png' % (a, e, 0, int(1000*d)))
         lbl_file = osp.join(args.output_folder, 'labels', 'syn_a%03d_e%03d_t%03d_d%04d.txt' % (a, e, 0, int(1000*d))) 
         tmp_string = '%f %f 0 %f %s %s\n' % (a, e, d, img_file, lbl_file)
-        view_fout.write(tmp_string)
-view_fout.close()
-render_cmd = '%s %s --background --python %s -- %s %s %s %s %s %s' % (g_blender_executable_path, blank_file, render_code, args.model_file, args.keypoint_file, 'xxx', view_file, temp_dirname, args.scale)
-os.system(render_cmd)
+        view_lines.append(tmp_string)
+
+# contiguous shards of views, each rendered by one blender process
+shard_num = max(1, min(args.shards or 4*args.jobs, len(view_lines)))
+shard_bounds = np.linspace(0, len(view_lines), shard_num+1).astype(int)
+render_cmds = []
+for k in range(shard_num):
+    view_file = osp.join(temp_dirname, 'view_%04d.txt' % (k))
+    with open(view_file, 'w') as view_fout:
+        view_fout.writelines(view_lines[shard_bounds[k]:shard_bounds[k+1]])
+    render_cmd = '%s %s --background --python %s -- %s %s %s %s %s %s --visibility %s --depth_threshold %s' % (g_blender_executable_path, blank_file, render_code, args.model_file, args.keypoint_file, 'xxx', view_file, temp_dirname, args.scale, args.visibility, args.depth_threshold)
+    if args.lod:
+        render_cmd += ' --lod'
+    if args.label_store:
+        render_cmd += ' --label_store %s' % (osp.join(temp_dirname, 'labels_%04d.npz' % (k)))
+    if args.seed is not None:
+        # lighting is seeded per view, outputs do not depend on the sharding
+        render_cmd += ' --seed %d --view_offset %d' % (args.seed, shard_bounds[k])
+    render_cmd += ' > %s 2>&1' % (osp.join(temp_dirname, 'log_%04d.txt' % (k)))
+    render_cmds.append(render_cmd)
+
+print('Rendering %d views in %d shards with %d blender processes...' % (len(view_lines), shard_num, args.jobs))
+t_begin = time.time()
+image_files = [line.split(' ')[4] for line in view_lines]
+pool = Pool(args.jobs)
+results = pool.map_async(lambda cmd: call(cmd, shell=True), render_cmds)
+while not results.ready():
+    results.wait(30)
+    # images left in output_folder by an earlier run do not count
+    rendered_num = len([x for x in image_files if osp.exists(x) and osp.getmtime(x) >= int(t_begin)])
+    print('[%s] %d/%d views rendered' % (datetime.datetime.now().time(), rendered_num, len(view_lines)))
+pool.close()
+failed_shards = [k for k, return_code in enumerate(results.get()) if return_code != 0]
+for k in failed_shards:
+    print('Shard %d failed, see %s' % (k, osp.join(temp_dirname, 'log_%04d.txt' % (k))))
+
+if args.label_store and len(failed_shards) == 0:
+    # one label store for all views, in the order of the view list
+    stores = [load_keypoint_store(osp.join(temp_dirname, 'labels_%04d.npz' % (k))) for k in range(shard_num)]
+    write_keypoint_store(osp.join(args.output_folder, 'labels.npz'), np.concatenate([x['views'] for x in stores]), np.concatenate([x['image_files'] for x in stores]), 
+                         stores[0]['keypoint_ids'], np.concatenate([x['keypoints'] for x in stores]), int(stores[0]['vert_num']))
+print('%f seconds spent on rendering!' % (time.time() - t_begin))
+if len(failed_shards) > 0:
+    print('%d of %d shards failed, temporary files kept in %s' % (len(failed_shards), shard_num, temp_dirname))
+    sys.exit(1)
+shutil.rmtree(temp_dirname)
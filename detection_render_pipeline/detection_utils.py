@@ -1,24 +1,77 @@
+import os
+import sys
 import glob
+import multiprocessing
 import cv2
+import numpy as np
 import matplotlib.pyplot as plt
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(BASE_DIR), 'render_pipeline'))
+from bbox_sidecar import read_bbox_sidecar
+
+def image_bbox(im):
+    """Bounding box [x1, y1, x2, y2] of the non-black pixels of an image, None if it is all black.
+    Computed from row and column reductions, no index arrays of all pixels are built"""
+    foreground = im.any(axis=-1) if im.ndim == 3 else (im != 0)
+    cols = np.flatnonzero(foreground.any(axis=0))
+    if len(cols) == 0:
+        return None
+    rows = np.flatnonzero(foreground.any(axis=1))
+    return [int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])]
+
 def get_bbox(im_file, visualize=False):
     """Gets bounding box of a single object in a image against a black background"""
     im = cv2.imread(im_file)
-    non_black_pixels = im.any(axis=-1).nonzero() 
-    bbox = [min(non_black_pixels[1][:]), min(non_black_pixels[0][:]),
-            max(non_black_pixels[1][:]), max(non_black_pixels[0][:])]
-    if visualize:
+    if im is None:
+        return None
+    bbox = image_bbox(im)
+    if visualize and bbox is not None:
         vis_bbox(im, bbox)
         plt.show()
     return bbox
 
-def get_bboxes(path_rendered_images, output_file, ext='.jpg'):
+def iter_bbox_tasks(path_rendered_images, ext, use_sidecar):
+    """(im_file, bbox) for path_rendered_images/*/*ext, bbox is None if it is not in the bbox sidecar
+    of the folder (see render_pipeline/bbox_sidecar.py). Images are matched by name without extension"""
+    for folder in sorted(glob.glob(os.path.join(path_rendered_images, '*'))):
+        if not os.path.isdir(folder):
+            continue
+        sidecar_bboxes = {}
+        if use_sidecar:
+            for filename, bbox in read_bbox_sidecar(folder).items():
+                sidecar_bboxes[os.path.splitext(filename)[0]] = bbox[0:4]
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(ext):
+                yield (os.path.join(folder, filename), sidecar_bboxes.get(os.path.splitext(filename)[0]))
+
+def get_bbox_task(task):
+    im_file, bbox = task
+    if bbox is None:
+        bbox = get_bbox(im_file)
+    return (im_file, bbox)
+
+def get_bboxes(path_rendered_images, output_file, ext='.jpg', num_workers=None, use_sidecar=True):
+    """Bounding boxes of all path_rendered_images/*/*ext images, written to output_file as they are
+    computed by a process pool (one '<im_file> <x1> <y1> <x2> <y2>' line per image, in no particular
+    order). Bounding boxes found in sidecar files are used without reading the images."""
+    pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+    image_num = 0
+    failed_num = 0
     with open(output_file, 'w') as f:
-        for im_file in glob.glob(path_rendered_images+'/*/*'+ext):
-            f.write('%s '%im_file)
-            bbox =  get_bbox(im_file)
-            f.write('%s %s %s %s\n'%(tuple(bbox)))
+        for im_file, bbox in pool.imap_unordered(get_bbox_task, iter_bbox_tasks(path_rendered_images, ext, use_sidecar), chunksize=32):
+            image_num += 1
+            if bbox is None:
+                failed_num += 1
+                print('Failed to get the bbox of %s (unreadable or empty image)' % (im_file))
+                continue
+            f.write('%s %s %s %s %s\n' % tuple([im_file] + bbox))
+            if image_num % 10000 == 0:
+                f.flush()
+                print('%d images done' % (image_num))
+    pool.close()
+    pool.join()
+    print('%d images in total, %d failed' % (image_num, failed_num))
 
 def vis_bbox(im, bbox):
     """Draw detected bounding boxes. Adapted from Ross Girshick's Fast R-CNN"""
@@ -35,4 +88,3 @@ def vis_bbox(im, bbox):
     plt.axis('off')
     plt.tight_layout()
     plt.draw()
-
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BACKGROUND_CACHE.py
+brief:
+	cache of decoded background images shared by all overlay processes of a host.
+	each background is decoded once and saved as a .npy file in the cache folder (by default
+	in /dev/shm, i.e. in memory); processes memory-map these files, so the pixels are shared
+	and read without copies or JPEG decoding. When the files in the cache exceed the memory
+	budget, the least recently used ones are removed.
+'''
+
+import os
+import numpy as np
+from PIL import Image
+
+class BackgroundCache(object):
+    '''
+    @input:
+        bkg_folder - folder of the background images
+        cache_folder - folder of the decoded .npy files, created if needed
+        budget - maximum total size of the cache in bytes
+    '''
+    def __init__(self, bkg_folder, cache_folder, budget):
+        self.bkg_folder = bkg_folder
+        self.cache_folder = cache_folder
+        self.budget = budget
+        # size of the cache is re-measured every rescan_step misses of this process
+        self.rescan_step = 100
+        self.miss_num = 0
+        if not os.path.exists(cache_folder):
+            try:
+                os.makedirs(cache_folder)
+            except OSError: # created by another process meanwhile
+                pass
+
+    def cache_file(self, name):
+        return os.path.join(self.cache_folder, name.replace(os.sep, '__') + '.npy')
+
+    '''
+    @input:
+        name - background filename relative to bkg_folder
+    @output:
+        HxWxC uint8 read-only array of the decoded background
+    '''
+    def get(self, name):
+        cache_file = self.cache_file(name)
+        try:
+            bg = np.load(cache_file, mmap_mode='r')
+            os.utime(cache_file, None) # mark as recently used
+            return bg
+        except (IOError, OSError, ValueError):
+            pass
+
+        bg = np.asarray(Image.open(os.path.join(self.bkg_folder, name)))
+        # write under a temporary name first so other processes never map a partial file
+        tmp_cache_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_cache_file, 'wb') as f:
+            np.save(f, bg)
+        os.rename(tmp_cache_file, cache_file)
+        self.miss_num += 1
+        if self.miss_num % self.rescan_step == 0:
+            self.evict()
+        return bg
+
+    '''
+    @brief:
+        remove least recently used files until the cache is below 90% of its budget
+    '''
+    def evict(self):
+        files = []
+        for filename in os.listdir(self.cache_folder):
+            if not filename.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_folder, filename))
+            except OSError: # evicted by another process meanwhile
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        total_size = sum([x[1] for x in files])
+        if total_size <= self.budget:
+            return
+        for mtime, size, filename in sorted(files):
+            try:
+                # processes that mapped the file keep their mapping
+                os.remove(os.path.join(self.cache_folder, filename))
+            except OSError:
+                pass
+            total_size -= size
+            if total_size <= 0.9 * self.budget:
+                break
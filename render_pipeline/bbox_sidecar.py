@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BBOX_SIDECAR.py
+brief:
+	per-folder file (g_bbox_sidecar_filename) of object bounding boxes written by the renderers,
+	so that later stages (crop, detection) do not have to scan the pixels again.
+	each line is '<image filename> <x1> <y1> <x2> <y2> [<crop x1> <crop y1> <crop x2> <crop y2>]':
+	tight box of the object in the saved image and, for images cropped at render time, the crop box
+	in the full rendered frame. boxes are in pixels, 0-based and inclusive.
+	other per-image records of integers (e.g. g_syn_lod_sidecar_filename) use the same format.
+'''
+
+import os
+import sys
+import fcntl
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+
+'''
+@output:
+    dict from image filename to the list of integers of its line, empty if there is no sidecar
+'''
+def read_bbox_sidecar(folder, sidecar_filename=g_bbox_sidecar_filename):
+    sidecar_file = os.path.join(folder, sidecar_filename)
+    bboxes = {}
+    if not os.path.exists(sidecar_file):
+        return bboxes
+    for line in open(sidecar_file, 'r'):
+        ll = line.split()
+        if len(ll) >= 2:
+            bboxes[ll[0]] = [int(x) for x in ll[1:]]
+    return bboxes
+
+'''
+@input:
+    bboxes - dict from image filename to the list of integers of its line
+@output:
+    lines of the sidecar of folder added or replaced. several processes may update the same
+    sidecar, the file is locked and replaced atomically
+'''
+def update_bbox_sidecar(folder, bboxes, sidecar_filename=g_bbox_sidecar_filename):
+    if len(bboxes) == 0:
+        return
+    sidecar_file = os.path.join(folder, sidecar_filename)
+    with open(sidecar_file + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        all_bboxes = read_bbox_sidecar(folder, sidecar_filename)
+        all_bboxes.update(bboxes)
+        tmp_sidecar_file = '%s.%d.tmp' % (sidecar_file, os.getpid())
+        with open(tmp_sidecar_file, 'w') as fout:
+            for filename in sorted(all_bboxes.keys()):
+                fout.write('%s %s\n' % (filename, ' '.join(['%d' % (x) for x in all_bboxes[filename]])))
+        os.rename(tmp_sidecar_file, sidecar_file)
+        fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BENCHMARK_KEYPOINT_VISIBILITY.py
+brief:
+	compare the BVH keypoint visibility test of keypoint_utils.py with the polygon loop
+	render_model.py used before (speed and agreement of the results).
+	with --zbuffer, the views are also rendered and the z-buffer test of render_model.py
+	(--visibility zbuffer) is validated against the BVH test.
+usage:
+	blender blank.blend --background --python benchmark_keypoint_visibility.py -- [--shape_file <.obj/.ply>] [--views 4] [--keypoints 20] [--zbuffer] [--depth_threshold 0.01]
+
+	without a shape file, a high-poly scene (two overlapping spheres, ~130k polygons) is generated.
+'''
+
+import os
+import bpy
+import sys
+import time
+import random
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_pipeline.blender_utils import *
+from render_pipeline.scene_utils import *
+from render_pipeline.keypoint_utils import *
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='Benchmark keypoint visibility tests')
+    parser.add_argument('--shape_file', default=None, help='model to test, a generated high-poly scene by default')
+    parser.add_argument('--views', type=int, default=4, help='number of random views')
+    parser.add_argument('--keypoints', type=int, default=20, help='number of random vertices tested per view')
+    parser.add_argument('--zbuffer', action='store_true', help='also validate the z-buffer test (renders the views)')
+    parser.add_argument('--depth_threshold', type=float, default=0.01, help='relative depth tolerance of the z-buffer test')
+    args = parser.parse_args(argv)
+
+    clear_shapes()
+    if args.shape_file is not None:
+        import_shape(args.shape_file)
+    else:
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=256, ring_count=256, size=0.5, location=(0, 0, 0))
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=256, ring_count=256, size=0.3, location=(0.4, 0.2, 0.3))
+    objs = [ob for ob in bpy.context.scene.objects if ob.type == 'MESH']
+    verts = []
+    polygons = []
+    for ob in objs:
+        polygons += [[k + len(verts) for k in polygon.vertices] for polygon in ob.data.polygons]
+        verts += [ob.matrix_world * vert.co for vert in ob.data.vertices]
+    print('%d vertices, %d polygons' % (len(verts), len(polygons)))
+
+    start_time = time.time()
+    tester = VisibilityTester(verts, polygons)
+    print('BVH built in %f seconds' % (time.time() - start_time))
+
+    random.seed(0)
+    cam_locations, cam_quaternions = batch_camera_poses([[random.uniform(0, 360), random.uniform(-90, 90), 0, random.uniform(1, 3)] for _ in range(args.views)])
+    bvh_seconds = 0
+    loop_seconds = 0
+    mismatch_num = 0
+    test_num = 0
+    for eye_location in cam_locations:
+        for vert_idx in random.sample(range(len(verts)), min(args.keypoints, len(verts))):
+            start_time = time.time()
+            bvh_vis = tester.is_visible(vert_idx, eye_location)
+            bvh_seconds += time.time() - start_time
+            start_time = time.time()
+            loop_vis = is_visible_brute_force(verts, polygons, vert_idx, eye_location)
+            loop_seconds += time.time() - start_time
+            test_num += 1
+            if bvh_vis != loop_vis:
+                mismatch_num += 1
+                print('Mismatch: vertex %d from %s, bvh %s, loop %s' % (vert_idx, tuple(eye_location), bvh_vis, loop_vis))
+
+    print('%d tests, %d mismatches' % (test_num, mismatch_num))
+    print('polygon loop: %f ms per keypoint' % (loop_seconds * 1000 / test_num))
+    print('bvh:          %f ms per keypoint' % (bvh_seconds * 1000 / test_num))
+    print('speedup:      %.1fx' % (loop_seconds / max(bvh_seconds, 1e-9)))
+
+    if args.zbuffer:
+        scene = bpy.context.scene
+        render_scale = scene.render.resolution_percentage / 100
+        render_size = (int(scene.render.resolution_x * render_scale), int(scene.render.resolution_y * render_scale))
+        camObj = bpy.data.objects['Camera']
+        enable_depth_viewer_node()
+        kp_coords = np.array([tuple(vert) for vert in verts])
+        zbuffer_seconds = 0
+        bvh_seconds = 0
+        agree_num = 0
+        test_num = 0
+        for eye_location, q in zip(cam_locations, cam_quaternions):
+            camObj.location = tuple(eye_location)
+            camObj.rotation_mode = 'QUATERNION'
+            camObj.rotation_quaternion = tuple(q)
+            scene.update()
+            bpy.ops.render.render()
+            start_time = time.time()
+            coords_2d = project_points(camera_projection_matrix(scene, camObj, render_size), kp_coords, render_size)
+            zbuffer_vis = zbuffer_visibility(coords_2d, camera_depths(camObj, kp_coords), get_viewer_depth(), args.depth_threshold)
+            zbuffer_seconds += time.time() - start_time
+            # as render_model.py, only keypoints inside the image are tested
+            inside = np.flatnonzero((coords_2d[:,0] >= 0) & (coords_2d[:,0] < render_size[0]) & (coords_2d[:,1] >= 0) & (coords_2d[:,1] < render_size[1]))
+            for vert_idx in random.sample(list(inside), min(args.keypoints, len(inside))):
+                start_time = time.time()
+                bvh_vis = tester.is_visible(vert_idx, camObj.location)
+                bvh_seconds += time.time() - start_time
+                test_num += 1
+                agree_num += (bvh_vis == zbuffer_vis[vert_idx])
+        print('z-buffer vs bvh: %d of %d keypoints agree (%.2f%%)' % (agree_num, test_num, 100.0 * agree_num / max(test_num, 1)))
+        print('z-buffer: %f ms per view for all %d vertices (rendering excluded)' % (zbuffer_seconds * 1000 / len(cam_locations), len(verts)))
+        print('bvh:      %f ms per keypoint' % (bvh_seconds * 1000 / max(test_num, 1)))
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BENCHMARK_RENDER_BBOX.py
+brief:
+	time a plain render (render_still, the default) against a render whose pixels are read back
+	for the bbox sidecar (render_with_bbox, g_syn_render_bbox_sidecar), and the readback alone.
+usage:
+	blender blank.blend --background --python benchmark_render_bbox.py -- [--shape_file <.obj/.ply>] [--views 10]
+
+	without a shape file, a sphere is rendered.
+'''
+
+import os
+import bpy
+import sys
+import time
+import random
+import argparse
+import tempfile
+import shutil
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_pipeline.blender_utils import *
+from render_pipeline.scene_utils import *
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='Benchmark the pixel readback of render_with_bbox')
+    parser.add_argument('--shape_file', default=None, help='model to render, a sphere by default')
+    parser.add_argument('--views', type=int, default=10, help='number of random views')
+    args = parser.parse_args(argv)
+
+    clear_shapes()
+    if args.shape_file is not None:
+        import_shape(args.shape_file)
+    else:
+        bpy.ops.mesh.primitive_uv_sphere_add(segments=64, ring_count=64, size=0.5, location=(0, 0, 0))
+    scene = bpy.context.scene
+    scene.render.alpha_mode = 'TRANSPARENT'
+    camObj = bpy.data.objects['Camera']
+    output_folder = tempfile.mkdtemp()
+
+    random.seed(0)
+    cam_locations, cam_quaternions = batch_camera_poses([[random.uniform(0, 360), random.uniform(-90, 90), 0, random.uniform(1, 3)] for _ in range(args.views)])
+    seconds = {'render_still': 0, 'render_with_bbox': 0, 'readback': 0}
+    for view_idx, (location, q) in enumerate(zip(cam_locations, cam_quaternions)):
+        camObj.location = tuple(location)
+        camObj.rotation_mode = 'QUATERNION'
+        camObj.rotation_quaternion = tuple(q)
+        scene.update()
+        # alternate the order, so that caches warmed by the first render do not favour one of them
+        for render in ([render_still, render_with_bbox] if view_idx % 2 == 0 else [render_with_bbox, render_still]):
+            start_time = time.time()
+            render(os.path.join(output_folder, '%s_%04d.png' % (render.__name__, view_idx)))
+            seconds[render.__name__] += time.time() - start_time
+        start_time = time.time()
+        get_alpha_bbox(get_viewer_alpha(get_viewer_rgba()))
+        seconds['readback'] += time.time() - start_time
+    shutil.rmtree(output_folder)
+
+    width, height = scene.render.resolution_x, scene.render.resolution_y
+    print('%d views at %dx%d (%d%%)' % (args.views, width, height, scene.render.resolution_percentage))
+    print('render_still:     %f ms per view' % (seconds['render_still'] * 1000 / args.views))
+    print('render_with_bbox: %f ms per view' % (seconds['render_with_bbox'] * 1000 / args.views))
+    print('readback only:    %f ms per view' % (seconds['readback'] * 1000 / args.views))
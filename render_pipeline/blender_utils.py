@@ -7,26 +7,7 @@ brief:
 author: hao su, charles r. qi, yangyan li
 '''
 import math
-
-def camPosToQuaternion(cx, cy, cz):
-    camDist = math.sqrt(cx * cx + cy * cy + cz * cz)
-    cx = cx / camDist
-    cy = cy / camDist
-    cz = cz / camDist
-    axis = (-cz, 0, cx)
-    angle = math.acos(cy)
-    a = math.sqrt(2) / 2
-    b = math.sqrt(2) / 2
-    w1 = axis[0]
-    w2 = axis[1]
-    w3 = axis[2]
-    c = math.cos(angle / 2)
-    d = math.sin(angle / 2)
-    q1 = a * c - b * d * w1
-    q2 = b * c + a * d * w1
-    q3 = a * d * w2 + b * d * w3
-    q4 = -b * d * w2 + a * d * w3
-    return (q1, q2, q3, q4)
+import numpy as np
 
 def quaternionFromYawPitchRoll(yaw, pitch, roll):
     c1 = math.cos(yaw / 2.0)
@@ -62,7 +43,6 @@ def camPosToQuaternion(cx, cy, cz):
     roll = math.acos(tmp)
     if cz < 0:
         roll = -roll    
-    print("%f %f %f" % (yaw, pitch, roll))
     q2a, q2b, q2c, q2d = quaternionFromYawPitchRoll(yaw, pitch, roll)    
     q1 = q1a * q2a - q1b * q2b - q1c * q2c - q1d * q2d
     q2 = q1b * q2a + q1a * q2b + q1d * q2c - q1c * q2d
@@ -104,3 +84,96 @@ def obj_centened_camera_pos(dist, azimuth_deg, elevation_deg):
     y = (dist * math.sin(theta) * math.cos(phi))
     z = (dist * math.sin(phi))
     return (x, y, z)
+
+# ------------------------------------------------------------
+# batch versions of the functions above, computing all views at once.
+# inputs are arrays of length N, outputs are Nx3 locations or Nx4 quaternions
+# ------------------------------------------------------------
+
+def batchQuaternionFromYawPitchRoll(yaw, pitch, roll):
+    c1 = np.cos(yaw / 2.0)
+    c2 = np.cos(pitch / 2.0)
+    c3 = np.cos(roll / 2.0)
+    s1 = np.sin(yaw / 2.0)
+    s2 = np.sin(pitch / 2.0)
+    s3 = np.sin(roll / 2.0)
+    q1 = c1 * c2 * c3 + s1 * s2 * s3
+    q2 = c1 * c2 * s3 - s1 * s2 * c3
+    q3 = c1 * s2 * c3 + s1 * c2 * s3
+    q4 = s1 * c2 * c3 - c1 * s2 * s3
+    return np.stack([q1, q2, q3, q4], axis=-1)
+
+def batchCamPosToQuaternion(cx, cy, cz):
+    q1a = 0
+    q1b = 0
+    q1c = math.sqrt(2) / 2
+    q1d = math.sqrt(2) / 2
+    camDist = np.sqrt(cx * cx + cy * cy + cz * cz)
+    cx = cx / camDist
+    cy = cy / camDist
+    cz = cz / camDist
+    t = np.sqrt(cx * cx + cy * cy)
+    # camera straight above/below the object: the scalar version divides by zero, use yaw 0
+    t_safe = np.where(t > 0, t, 1)
+    tx = np.where(t > 0, cx / t_safe, 0)
+    ty = np.where(t > 0, cy / t_safe, 1)
+    yaw = np.arccos(np.clip(ty, -1, 1))
+    yaw = np.where(tx > 0, 2 * math.pi - yaw, yaw)
+    pitch = np.zeros_like(yaw)
+    roll = np.arccos(np.clip(tx*cx + ty*cy, -1, 1))
+    roll = np.where(cz < 0, -roll, roll)
+    q2 = batchQuaternionFromYawPitchRoll(yaw, pitch, roll)
+    q2a, q2b, q2c, q2d = q2[:,0], q2[:,1], q2[:,2], q2[:,3]
+    q1 = q1a * q2a - q1b * q2b - q1c * q2c - q1d * q2d
+    q2 = q1b * q2a + q1a * q2b + q1d * q2c - q1c * q2d
+    q3 = q1c * q2a - q1d * q2b + q1a * q2c + q1b * q2d
+    q4 = q1d * q2a + q1c * q2b - q1b * q2c + q1a * q2d
+    return np.stack([q1, q2, q3, q4], axis=-1)
+
+def batchCamRotQuaternion(cx, cy, cz, theta):
+    theta = theta / 180.0 * math.pi
+    camDist = np.sqrt(cx * cx + cy * cy + cz * cz)
+    cx = -cx / camDist
+    cy = -cy / camDist
+    cz = -cz / camDist
+    q1 = np.cos(theta * 0.5)
+    q2 = -cx * np.sin(theta * 0.5)
+    q3 = -cy * np.sin(theta * 0.5)
+    q4 = -cz * np.sin(theta * 0.5)
+    return np.stack([q1, q2, q3, q4], axis=-1)
+
+def batchQuaternionProduct(qx, qy):
+    a, b, c, d = qx[:,0], qx[:,1], qx[:,2], qx[:,3]
+    e, f, g, h = qy[:,0], qy[:,1], qy[:,2], qy[:,3]
+    q1 = a * e - b * f - c * g - d * h
+    q2 = a * f + b * e + c * h - d * g
+    q3 = a * g - b * h + c * e + d * f
+    q4 = a * h + b * g - c * f + d * e
+    return np.stack([q1, q2, q3, q4], axis=-1)
+
+def batch_obj_centened_camera_pos(dist, azimuth_deg, elevation_deg):
+    phi = np.asarray(elevation_deg, dtype=np.float64) / 180 * math.pi
+    theta = np.asarray(azimuth_deg, dtype=np.float64) / 180 * math.pi
+    x = (dist * np.cos(theta) * np.cos(phi))
+    y = (dist * np.sin(theta) * np.cos(phi))
+    z = (dist * np.sin(phi))
+    return np.stack([x, y, z], axis=-1)
+
+'''
+@input:
+    view_params - Nx4 array-like, each row is azimuth, elevation, tilt (degrees) and distance
+                  as in the view parameter files (tilt is negated here to match pascal3d annotations)
+@output:
+    (locations, quaternions) - Nx3 camera locations and Nx4 camera rotation quaternions
+'''
+def batch_camera_poses(view_params):
+    view_params = np.asarray(view_params, dtype=np.float64).reshape(-1, 4)
+    azimuth_deg = view_params[:,0]
+    elevation_deg = view_params[:,1]
+    theta_deg = -1 * view_params[:,2]
+    rho = view_params[:,3]
+    locations = batch_obj_centened_camera_pos(rho, azimuth_deg, elevation_deg)
+    cx, cy, cz = locations[:,0], locations[:,1], locations[:,2]
+    q1 = batchCamPosToQuaternion(cx, cy, cz)
+    q2 = batchCamRotQuaternion(cx, cy, cz, theta_deg)
+    return (locations, batchQuaternionProduct(q2, q1))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BUILD_MESH_CACHE.py
+brief:
+	convert 3D models to .blend files in g_mesh_cache_folder (see mesh_cache.py)
+usage:
+	blender blank.blend --background --python build_mesh_cache.py -- <shape_filelist>
+
+inputs:
+       <shape_filelist>: txt file - each line is '<shape_filename> <cache_filename>'
+'''
+
+import os
+import bpy
+import sys
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_pipeline.scene_utils import *
+
+def build_mesh_cache(shape_file, cache_file):
+    # only the imported shape is saved, without blank.blend camera and lamp
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        scene.objects.unlink(obj)
+        bpy.data.objects.remove(obj)
+    clear_shapes()
+    import_shape_file(shape_file)
+    # textures are packed so that the cache file does not depend on the model folder
+    bpy.ops.file.pack_all()
+    tmp_cache_file = cache_file + '.tmp.blend'
+    bpy.ops.wm.save_as_mainfile(filepath=tmp_cache_file, copy=True)
+    os.rename(tmp_cache_file, cache_file)
+    write_mesh_cache_md5(shape_file, cache_file)
+
+if __name__ == '__main__':
+    shape_filelist = sys.argv[-1]
+    for line in open(shape_filelist, 'r'):
+        shape_file, cache_file = line.rstrip().split(' ')
+        try:
+            build_mesh_cache(shape_file, cache_file)
+        except Exception:
+            print('Failed to cache %s' % (shape_file))
+            traceback.print_exc()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+CHECK_BATCH_CAMERA_POSES.py
+brief:
+	compare batch_camera_poses of blender_utils.py with the per-view computation it replaced
+	(obj_centened_camera_pos, camPosToQuaternion, camRotQuaternion and quaternionProduct) on
+	random views, and time both. exits with status 1 if any location or quaternion differs by
+	more than --tolerance.
+usage:
+	python check_batch_camera_poses.py [-n 100000] [--seed 0] [--tolerance 1e-9]
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from blender_utils import *
+
+'''
+@output:
+    (location, quaternion) of one view as render_model_views.py computed them view by view
+'''
+def scalar_camera_pose(param):
+    azimuth_deg, elevation_deg, tilt_deg, rho = param
+    theta_deg = -1 * tilt_deg
+    cx, cy, cz = obj_centened_camera_pos(rho, azimuth_deg, elevation_deg)
+    q1 = camPosToQuaternion(cx, cy, cz)
+    q2 = camRotQuaternion(cx, cy, cz, theta_deg)
+    return ((cx, cy, cz), quaternionProduct(q2, q1))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check batch camera poses against the per-view functions')
+    parser.add_argument('-n', '--num', type=int, default=100000, help='number of random views')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='maximum absolute difference')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    view_params = np.stack([rng.uniform(0, 360, args.num), rng.uniform(-90, 90, args.num),
+                            rng.uniform(-180, 180, args.num), rng.uniform(0.5, 10, args.num)], axis=-1)
+    # integer degrees as in the view distribution files, including the poles
+    view_params[0:args.num//2,0:3] = np.round(view_params[0:args.num//2,0:3])
+    view_params[0:2,1] = [90, -90]
+
+    start_time = time.time()
+    scalar_poses = [scalar_camera_pose(param) for param in view_params.tolist()]
+    scalar_seconds = time.time() - start_time
+    start_time = time.time()
+    locations, quaternions = batch_camera_poses(view_params)
+    batch_seconds = time.time() - start_time
+    print('%d views: per-view %.3f s, batch %.3f s' % (args.num, scalar_seconds, batch_seconds))
+
+    scalar_locations = np.array([pose[0] for pose in scalar_poses])
+    scalar_quaternions = np.array([pose[1] for pose in scalar_poses])
+    location_diff = np.max(np.abs(locations - scalar_locations))
+    quaternion_diff = np.max(np.abs(quaternions - scalar_quaternions))
+    print('max abs difference: locations %g, quaternions %g' % (location_diff, quaternion_diff))
+    if not (location_diff <= args.tolerance and quaternion_diff <= args.tolerance):
+        worst = int(np.argmax(np.max(np.abs(quaternions - scalar_quaternions), axis=1)))
+        print('above tolerance %g, e.g. view %s' % (args.tolerance, view_params[worst].tolist()))
+        sys.exit(1)
+    print('batch and per-view poses agree within %g' % (args.tolerance))
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+CROP_IMAGES.py
+brief:
+	python replacement of crop_images.m: crop rendered images according to truncation parameters
+	sampled from a truncation distribution file, with a process pool sized to the machine.
+	image files are listed folder by folder while cropping is already running.
+	object boxes written by the renderer (bbox sidecars) are used instead of scanning the alpha channel.
+'''
+
+import os
+import sys
+import time
+import datetime
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from crop_utils import *
+from bbox_sidecar import read_bbox_sidecar
+
+'''
+@output:
+    generator of (src_image_file, dst_image_file) for src_folder/*/*.png, destination
+    folders are created on the way
+'''
+def iter_image_files(src_folder, dst_folder, ext='.png'):
+    for subfolder in sorted(os.listdir(src_folder)):
+        src_subfolder = os.path.join(src_folder, subfolder)
+        if not os.path.isdir(src_subfolder):
+            continue
+        dst_subfolder = os.path.join(dst_folder, subfolder)
+        if not os.path.exists(dst_subfolder):
+            os.makedirs(dst_subfolder)
+        for filename in sorted(os.listdir(src_subfolder)):
+            if filename.endswith(ext):
+                yield (os.path.join(src_subfolder, filename), os.path.join(dst_subfolder, filename))
+
+'''
+@output:
+    generator of (src_image_file, dst_image_file, bbox) as iter_image_files, bbox is the
+    (top, bottom, left, right) object box from the bbox sidecar of the image folder, None if unknown
+'''
+def iter_crop_tasks(src_folder, dst_folder):
+    sidecar_folder = None
+    sidecar_bboxes = {}
+    for src_image_file, dst_image_file in iter_image_files(src_folder, dst_folder):
+        if os.path.dirname(src_image_file) != sidecar_folder:
+            sidecar_folder = os.path.dirname(src_image_file)
+            sidecar_bboxes = read_bbox_sidecar(sidecar_folder)
+        bbox = sidecar_bboxes.get(os.path.basename(src_image_file))
+        if bbox is not None:
+            bbox = (bbox[1], bbox[3], bbox[0], bbox[2])
+        yield (src_image_file, dst_image_file, bbox)
+
+g_worker_truncation_params = None
+
+def init_crop_worker(truncation_params):
+    global g_worker_truncation_params
+    g_worker_truncation_params = truncation_params
+    # forked workers would otherwise share the same random state
+    np.random.seed((os.getpid() * 1000003 + int(time.time() * 1000)) % (2**32))
+
+'''
+@input:
+    (src_image_file, dst_image_file, bbox) as generated by iter_crop_tasks
+@output:
+    cropped image saved to dst_image_file, returns an error message or None
+'''
+def crop_one_image(src_dst_bbox):
+    src_image_file, dst_image_file, bbox = src_dst_bbox
+    try:
+        im = Image.open(src_image_file)
+        im.load()
+    except (IOError, OSError):
+        return 'Failed to read %s' % (src_image_file)
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+
+    truncation_param = g_worker_truncation_params[np.random.randint(len(g_worker_truncation_params))]
+    if bbox is not None:
+        crop_box = get_truncated_crop_box(bbox, truncation_param, (im.size[1], im.size[0]))
+    else:
+        crop_box = get_crop_box(np.asarray(im)[:,:,3], truncation_param)
+    if crop_box is None:
+        return 'Failed to crop %s (empty image after crop)' % (src_image_file)
+    top, bottom, left, right = crop_box
+    im.crop((left, top, right+1, bottom+1)).save(dst_image_file)
+    return None
+
+'''
+@input:
+    src_folder - folder of rendered images, <src_folder>/*/*.png
+    dst_folder - cropped images are saved with the same relative path
+    truncation_distr_file - each line is a truncation parameter (left, right, top, bottom)
+    num_workers - number of processes, all cpus by default, 0 to crop in this process
+'''
+def crop_images(src_folder, dst_folder, truncation_distr_file, num_workers=None):
+    truncation_params = [[float(x) for x in line.split()] for line in open(truncation_distr_file, 'r') if len(line.split()) == 4]
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+
+    print('Start croping at time %s...it takes for a while!!' % (datetime.datetime.now().time()))
+    t_begin = time.time()
+    report_step = 10000
+    image_num = 0
+    failed_num = 0
+    if num_workers == 0:
+        init_crop_worker(truncation_params)
+        results = (crop_one_image(x) for x in iter_crop_tasks(src_folder, dst_folder))
+    else:
+        pool = multiprocessing.Pool(num_workers, initializer=init_crop_worker, initargs=(truncation_params,))
+        results = pool.imap_unordered(crop_one_image, iter_crop_tasks(src_folder, dst_folder), chunksize=64)
+    for error in results:
+        image_num += 1
+        if error is not None:
+            failed_num += 1
+            print(error)
+        if image_num % report_step == 0:
+            print('[%s] %d images cropped' % (datetime.datetime.now().time(), image_num))
+    if num_workers != 0:
+        pool.close()
+        pool.join()
+    print('%d images in total, %d failed.' % (image_num, failed_num))
+    print('%f seconds spent on cropping!' % (time.time() - t_begin))
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+CROP_UTILS.py
+brief:
+	numpy port of crop_gray.m: crop box of an object from its alpha channel,
+	stretched or truncated according to a truncation parameter.
+	used both inside blender (cropping at render time) and by the python crop stage.
+'''
+import math
+import numpy as np
+
+'''
+@input:
+    alpha - HxW alpha channel (uint8)
+    bg_color - alpha value of the background
+@output:
+    (top, bottom, left, right) tight box of non-background pixels, 0-based and inclusive,
+    None if the image is empty
+'''
+def get_alpha_bbox(alpha, bg_color=0):
+    foreground = (alpha != bg_color)
+    cols = np.flatnonzero(foreground.any(axis=0))
+    if len(cols) == 0:
+        return None
+    rows = np.flatnonzero(foreground.any(axis=1))
+    return (int(rows[0]), int(rows[-1]), int(cols[0]), int(cols[-1]))
+
+def matlab_round(x):
+    return int(math.floor(x + 0.5))
+
+'''
+@input:
+    bbox - (top, bottom, left, right) as returned by get_alpha_bbox
+    truncation_param - (left, right, top, bottom) shifts of the box sides relative to its width/height,
+                       one line of g_truncation_distribution_files
+    image_size - (height, width) of the image
+@output:
+    (top, bottom, left, right) crop box, 0-based and inclusive, same as crop_gray.m
+'''
+def get_truncated_crop_box(bbox, truncation_param, image_size):
+    nr, nc = image_size
+    # crop_gray.m works on 1-based indices
+    top, bottom, left, right = [x + 1 for x in bbox]
+
+    width = right - left + 1
+    height = bottom - top + 1
+
+    # strecth
+    dx1 = width * truncation_param[0] # left
+    dx2 = width * truncation_param[1] # right
+    dy1 = height * truncation_param[2] # top
+    dy2 = height * truncation_param[3] # bottom
+
+    leftnew = min(max(1, left + dx1), nc)
+    rightnew = min(max(1, right + dx2), nc)
+    if leftnew > rightnew:
+        leftnew = left
+        rightnew = right
+
+    topnew = min(max(1, top + dy1), nr)
+    bottomnew = min(max(1, bottom + dy2), nr)
+    if topnew > bottomnew:
+        topnew = top
+        bottomnew = bottom
+
+    return (matlab_round(topnew) - 1, matlab_round(bottomnew) - 1, matlab_round(leftnew) - 1, matlab_round(rightnew) - 1)
+
+'''
+@output:
+    crop box of an image from its alpha channel, see get_truncated_crop_box, None if the image is empty
+'''
+def get_crop_box(alpha, truncation_param, bg_color=0):
+    bbox = get_alpha_bbox(alpha, bg_color)
+    if bbox is None:
+        return None
+    return get_truncated_crop_box(bbox, truncation_param, alpha.shape[0:2])
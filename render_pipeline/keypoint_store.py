@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+KEYPOINT_STORE.py
+brief:
+	all keypoint labels of a shape in one uncompressed .npz file instead of one txt file per view
+	(see render_model.py --label_store). members:
+	    views        - Nx4 float32, azimuth, elevation, tilt and distance of each view
+	    image_files  - N image filenames
+	    keypoint_ids - K int32, indices of the keypoints in the label txt files
+	    keypoints    - NxKx2 int16, pixel coordinates (x, y) of the keypoints, -1 if not visible
+	    vert_num     - number of lines of a label txt file (keypoints are a subset of them)
+	load_keypoint_store memory-maps the members, so only the views that are read are loaded.
+'''
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+'''
+@output:
+    store_file written atomically (through a temporary file)
+'''
+def write_keypoint_store(store_file, views, image_files, keypoint_ids, keypoints, vert_num):
+    tmp_store_file = store_file + '.tmp'
+    with open(tmp_store_file, 'wb') as f:
+        np.savez(f, views=np.asarray(views, dtype=np.float32), image_files=np.array(image_files),
+                 keypoint_ids=np.asarray(keypoint_ids, dtype=np.int32), keypoints=np.asarray(keypoints, dtype=np.int16),
+                 vert_num=np.array(vert_num))
+    os.rename(tmp_store_file, store_file)
+
+'''
+@output:
+    dict from member name to a read-only array, memory-mapped from store_file
+    (members that are compressed are read into memory)
+'''
+def load_keypoint_store(store_file):
+    store = {}
+    with zipfile.ZipFile(store_file, 'r') as zf, open(store_file, 'rb') as f:
+        for info in zf.infolist():
+            name = os.path.splitext(info.filename)[0]
+            if info.compress_type != zipfile.ZIP_STORED:
+                store[name] = np.load(zf.open(info))
+                continue
+            # member data follows its local header: 30 bytes + filename + extra field
+            f.seek(info.header_offset + 26)
+            filename_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + filename_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if len(shape) == 0 or 0 in shape:
+                f.seek(info.header_offset + 30 + filename_len + extra_len)
+                store[name] = np.lib.format.read_array(f)
+                continue
+            store[name] = np.memmap(store_file, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                    order='F' if fortran_order else 'C')
+    return store
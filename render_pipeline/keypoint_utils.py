@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+KEYPOINT_UTILS.py
+brief:
+	keypoint visibility test of render_model.py. A vertex is visible if the ray from the vertex
+	towards the camera does not cross the triangle (first three vertices) of any polygon that
+	does not contain the vertex. The triangles are put in a BVH tree once per mesh, so each test
+	is a few ray casts instead of a loop over all polygons.
+	keypoints are projected to the image with one matrix multiply per view.
+	alternatively, keypoints are visible if they are not behind the rendered depth (zbuffer_visibility).
+	only usable inside blender.
+'''
+
+import numpy as np
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+from mathutils.geometry import intersect_ray_tri
+
+class VisibilityTester(object):
+    '''
+    @input:
+        verts - world coordinates of the mesh vertices
+        polygons - vertex indices of each polygon
+    '''
+    def __init__(self, verts, polygons):
+        self.verts = [Vector(vert) for vert in verts]
+        self.tris = [tuple(polygon[0:3]) for polygon in polygons]
+        self.bvh = BVHTree.FromPolygons(self.verts, self.tris)
+        # polygons containing a vertex never occlude it
+        self.vert_tris = [set() for _ in self.verts]
+        for tri_idx, polygon in enumerate(polygons):
+            for vert_idx in polygon:
+                self.vert_tris[vert_idx].add(tri_idx)
+        # rays start slightly off the vertex, triangles closer than that are tested exactly
+        bbox_min = Vector([min([vert[k] for vert in self.verts]) for k in range(3)])
+        bbox_max = Vector([max([vert[k] for vert in self.verts]) for k in range(3)])
+        self.epsilon = max((bbox_max - bbox_min).length, 1.0) * 1e-6
+
+    '''
+    @input:
+        vert_idx - index of the vertex
+        eye_location - camera location in world coordinates
+    @output:
+        True if no triangle lies on the ray from the vertex towards (and beyond) the camera
+    '''
+    def is_visible(self, vert_idx, eye_location):
+        orig = self.verts[vert_idx]
+        ray = Vector(eye_location) - orig
+        own_tris = self.vert_tris[vert_idx]
+        for location, normal, tri_idx, dist in self.bvh.find_nearest_range(orig, self.epsilon):
+            if tri_idx in own_tris:
+                continue
+            v1, v2, v3 = [self.verts[k] for k in self.tris[tri_idx]]
+            if intersect_ray_tri(v1, v2, v3, ray, orig) is not None:
+                return False
+        direction = ray.normalized()
+        origin = orig + direction * self.epsilon
+        while True:
+            location, normal, tri_idx, dist = self.bvh.ray_cast(origin, direction)
+            if location is None:
+                return True
+            if tri_idx not in own_tris:
+                return False
+            origin = location + direction * self.epsilon
+
+'''
+@brief:
+    reference implementation of VisibilityTester.is_visible, loops over all polygons
+'''
+def is_visible_brute_force(verts, polygons, vert_idx, eye_location):
+    orig = Vector(verts[vert_idx])
+    ray = Vector(eye_location) - orig
+    for polygon in polygons:
+        if vert_idx in polygon:
+            continue
+        v1 = Vector(verts[polygon[0]])
+        v2 = Vector(verts[polygon[1]])
+        v3 = Vector(verts[polygon[2]])
+        if intersect_ray_tri(v1, v2, v3, ray, orig) is not None:
+            return False
+    return True
+
+'''
+@input:
+    scene, cam - blender scene and camera object (call scene.update() after moving the camera)
+    render_size - (width, height) of the rendered image in pixels
+@output:
+    3x4 matrix P, pixel coordinates of a world point X are (u/w, v/w) with (u, v, w) = P * (X, 1),
+    same as world_to_camera_view scaled to pixels (y going down from the top of the image)
+'''
+def camera_projection_matrix(scene, cam, render_size):
+    width, height = render_size
+    # as in bpy_extras.object_utils.world_to_camera_view
+    world_to_cam = np.array(cam.matrix_world.normalized().inverted())
+    view_frame = cam.data.view_frame(scene=scene)[:3]
+    if cam.data.type != 'ORTHO':
+        # frame corners at the depth of the point: corner * depth / corner.z
+        min_x, max_x = view_frame[1].x / view_frame[1].z, view_frame[2].x / view_frame[2].z
+        min_y, max_y = view_frame[0].y / view_frame[0].z, view_frame[1].y / view_frame[1].z
+        to_pixels = np.array([[width / (max_x - min_x), 0, width * min_x / (max_x - min_x), 0],
+                              [0, -height / (max_y - min_y), -height - height * min_y / (max_y - min_y), 0],
+                              [0, 0, -1, 0]])
+    else:
+        min_x, max_x = -view_frame[1].x, -view_frame[2].x
+        min_y, max_y = -view_frame[0].y, -view_frame[1].y
+        to_pixels = np.array([[width / (max_x - min_x), 0, 0, -width * min_x / (max_x - min_x)],
+                              [0, -height / (max_y - min_y), 0, height + height * min_y / (max_y - min_y)],
+                              [0, 0, 0, 1]])
+    return np.dot(to_pixels, world_to_cam)
+
+'''
+@input:
+    projection_matrix - as returned by camera_projection_matrix
+    points - Nx3 world coordinates
+    render_size - (width, height) of the rendered image in pixels
+@output:
+    Nx2 pixel coordinates (x, y), points in the camera plane go to the image center as in world_to_camera_view
+'''
+def project_points(projection_matrix, points, render_size):
+    uvw = np.dot(np.hstack([points, np.ones((len(points), 1))]), projection_matrix.T)
+    coords_2d = np.tile(np.array(render_size, dtype=np.float64) / 2, (len(points), 1))
+    in_plane = (uvw[:,2] == 0)
+    coords_2d[~in_plane] = uvw[~in_plane,0:2] / uvw[~in_plane,2:3]
+    return coords_2d
+
+'''
+@output:
+    depths (distance along the camera axis, as in the z pass) of Nx3 world points
+'''
+def camera_depths(cam, points):
+    world_to_cam = np.array(cam.matrix_world.normalized().inverted())
+    return -np.dot(np.hstack([points, np.ones((len(points), 1))]), world_to_cam[2])
+
+'''
+@input:
+    coords_2d - Nx2 pixel coordinates as returned by project_points
+    depths - N depths as returned by camera_depths
+    depth_buffer - HxW depth of the rendered view, see scene_utils.get_viewer_depth
+    depth_threshold - relative tolerance, a point is visible if the depth buffer at its pixel
+                      is at least depth * (1 - depth_threshold)
+@output:
+    N booleans, points outside the image or behind the camera are not visible
+'''
+def zbuffer_visibility(coords_2d, depths, depth_buffer, depth_threshold):
+    height, width = depth_buffer.shape
+    cols = np.floor(coords_2d[:,0]).astype(np.int64)
+    rows = np.floor(coords_2d[:,1]).astype(np.int64)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height) & (depths > 0)
+    visible = np.zeros(len(depths), dtype=bool)
+    visible[inside] = depth_buffer[rows[inside], cols[inside]] >= depths[inside] * (1 - depth_threshold)
+    return visible
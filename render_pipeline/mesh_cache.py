@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+MESH_CACHE.py
+brief:
+	shapes can be converted once to .blend files (see run_build_mesh_cache.py) which blender
+	loads much faster than parsing the original .obj/.ply text. Cache files are named by a key
+	of path, size and mtime of the source file and of the .mtl and texture files it references,
+	so that looking a shape up only stats a few files: g_mesh_cache_folder/<key>.blend
+	The md5 of the source file content is stored next to it (<key>.md5) when the cache file is
+	built, and is only compared on request (run_build_mesh_cache.py --verify).
+'''
+
+import os
+import sys
+import hashlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+
+def shape_file_hash(shape_file):
+    md5 = hashlib.md5()
+    with open(shape_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+'''
+@input:
+    mtl_file - .mtl material library
+@output:
+    existing texture files referenced by the map_*/bump/disp/decal/refl statements of mtl_file
+'''
+def mtl_texture_files(mtl_file):
+    texture_files = []
+    mtl_dir = os.path.dirname(mtl_file)
+    with open(mtl_file, 'rb') as f:
+        for line in f:
+            tokens = line.decode('utf-8', 'ignore').split()
+            if len(tokens) < 2:
+                continue
+            if tokens[0].startswith('map_') or tokens[0] in ('bump', 'disp', 'decal', 'refl'):
+                # options like -bm 1.0 come before the filename
+                texture_file = os.path.join(mtl_dir, tokens[-1].replace('\\', '/'))
+                if os.path.isfile(texture_file) and texture_file not in texture_files:
+                    texture_files.append(texture_file)
+    return texture_files
+
+'''
+@input:
+    shape_file - .obj/.ply/.dae file of the 3D shape model
+@output:
+    existing .mtl and texture files the shape is imported with, empty for non .obj files.
+    mtllib statements are read from the header of the .obj, up to the first face, which is
+    where exporters (and ShapeNet) put them, so the geometry is not parsed.
+'''
+def shape_dependency_files(shape_file):
+    if not shape_file.lower().endswith('.obj'):
+        return []
+    dependency_files = []
+    shape_dir = os.path.dirname(shape_file)
+    with open(shape_file, 'rb') as f:
+        for line in f:
+            if line.startswith(b'f '):
+                break
+            if not line.startswith(b'mtllib'):
+                continue
+            for name in line.decode('utf-8', 'ignore').split()[1:]:
+                mtl_file = os.path.join(shape_dir, name.replace('\\', '/'))
+                if os.path.isfile(mtl_file) and mtl_file not in dependency_files:
+                    dependency_files.append(mtl_file)
+                    dependency_files += [x for x in mtl_texture_files(mtl_file) if x not in dependency_files]
+    return dependency_files
+
+'''
+@output:
+    cache key of shape_file: md5 of path, size and mtime of shape_file and its dependency files
+'''
+def mesh_cache_key(shape_file):
+    md5 = hashlib.md5()
+    for filename in [shape_file] + shape_dependency_files(shape_file):
+        st = os.stat(filename)
+        md5.update(('%s %d %d\n' % (os.path.abspath(filename), st.st_size, st.st_mtime_ns if hasattr(st, 'st_mtime_ns') else int(st.st_mtime * 1e9))).encode('utf-8'))
+    return md5.hexdigest()
+
+'''
+@output:
+    cache filename of shape_file, whether it exists or not
+'''
+def mesh_cache_filename(shape_file):
+    return os.path.join(g_mesh_cache_folder, mesh_cache_key(shape_file) + '.blend')
+
+'''
+@output:
+    cache filename of shape_file, None if it is not cached yet
+'''
+def get_mesh_cache_file(shape_file):
+    if not os.path.isdir(g_mesh_cache_folder) or not os.path.exists(shape_file):
+        return None
+    cache_file = mesh_cache_filename(shape_file)
+    if not os.path.exists(cache_file):
+        return None
+    return cache_file
+
+'''
+@brief:
+    store the md5 of the source file content next to cache_file, see check_mesh_cache_file
+'''
+def write_mesh_cache_md5(shape_file, cache_file):
+    with open(cache_file[:-len('.blend')] + '.md5', 'w') as fout:
+        fout.write(shape_file_hash(shape_file) + '\n')
+
+'''
+@output:
+    True if the md5 stored with cache_file matches the current content of shape_file
+'''
+def check_mesh_cache_file(shape_file, cache_file):
+    md5_file = cache_file[:-len('.blend')] + '.md5'
+    if not os.path.exists(md5_file):
+        return False
+    return open(md5_file, 'r').read().strip() == shape_file_hash(shape_file)
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+OVERLAY_BACKGROUND.py
+brief:
+	python replacement of overlay_background.m: paste cropped rendered images onto random
+	backgrounds (SUN2012 images or a plain random color) with a process pool.
+	background sizes and channel numbers are read once into an index file, each line is
+	'<background filename> <width> <height> <channels>', so that backgrounds are only sampled
+	among the ones large enough and in color, instead of decoding and rejecting them.
+	decoded backgrounds can be shared between the workers through a BackgroundCache.
+'''
+
+import os
+import sys
+import time
+import datetime
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from crop_images import iter_image_files
+from background_cache import BackgroundCache
+
+def read_background_header(bkg_file):
+    try:
+        im = Image.open(bkg_file) # only reads the header
+    except (IOError, OSError):
+        return (0, 0, 0)
+    return (im.size[0], im.size[1], len(im.getbands()) if im.mode in ('L', 'RGB') else 0)
+
+'''
+@input:
+    bkg_filelist - txt file, each line is a background filename relative to bkg_folder
+@output:
+    index_file as described above
+'''
+def build_background_index(bkg_filelist, bkg_folder, index_file, num_workers=None):
+    names = [line.strip() for line in open(bkg_filelist, 'r') if line.strip()]
+    pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+    headers = pool.map(read_background_header, [os.path.join(bkg_folder, name) for name in names], chunksize=256)
+    pool.close()
+    tmp_index_file = index_file + '.tmp'
+    with open(tmp_index_file, 'w') as fout:
+        for name, (width, height, channels) in zip(names, headers):
+            fout.write('%s %d %d %d\n' % (name, width, height, channels))
+    os.rename(tmp_index_file, index_file)
+
+'''
+@output:
+    (names, widths, heights, channels), names is a list, the others are numpy arrays
+'''
+def load_background_index(index_file):
+    lines = [line.rstrip().rsplit(' ', 3) for line in open(index_file, 'r')]
+    names = [ll[0] for ll in lines]
+    widths = np.array([int(ll[1]) for ll in lines])
+    heights = np.array([int(ll[2]) for ll in lines])
+    channels = np.array([int(ll[3]) for ll in lines])
+    return (names, widths, heights, channels)
+
+'''
+@brief:
+    worker state: background index arrays, background folder, ratio of cluttered backgrounds
+    and BackgroundCache (None to decode backgrounds from bkg_folder every time)
+'''
+g_worker_state = None
+
+def init_overlay_worker(bkg_index, bkg_folder, cluttered_bkg_ratio, bkg_cache_folder=None, bkg_cache_budget=0):
+    global g_worker_state
+    bkg_cache = None
+    if bkg_cache_folder:
+        bkg_cache = BackgroundCache(bkg_folder, bkg_cache_folder, bkg_cache_budget)
+    g_worker_state = (bkg_index, bkg_folder, cluttered_bkg_ratio, bkg_cache)
+    # forked workers would otherwise share the same random state
+    np.random.seed((os.getpid() * 1000003 + int(time.time() * 1000)) % (2**32))
+
+'''
+@input:
+    (fh, fw) size of the image to overlay
+@output:
+    HxWx3 uint8 random crop of a random background at least as large as the image, None if there is none
+'''
+def sample_background_crop(fh, fw):
+    (names, widths, heights, channels), bkg_folder, _, bkg_cache = g_worker_state
+    candidates = np.flatnonzero((widths >= fw) & (heights >= fh) & (channels == 3))
+    if len(candidates) == 0:
+        return None
+    k = candidates[np.random.randint(len(candidates))]
+    by = np.random.randint(heights[k] - fh + 1)
+    bx = np.random.randint(widths[k] - fw + 1)
+    if bkg_cache is not None:
+        return bkg_cache.get(names[k])[by:by+fh, bx:bx+fw]
+    bg = Image.open(os.path.join(bkg_folder, names[k]))
+    return np.asarray(bg.crop((bx, by, bx+fw, by+fh)))
+
+'''
+@input:
+    rgba - HxWx4 uint8 image
+    bgcrop - HxWx3 uint8 background or a gray value
+@output:
+    HxWx3 uint8 alpha blended image
+'''
+def blend_background(rgba, bgcrop):
+    mask = rgba[:,:,3:4].astype(np.float32) / 255
+    blended = rgba[:,:,0:3] * mask + np.asarray(bgcrop, dtype=np.float32) * (1 - mask)
+    return np.clip(np.round(blended), 0, 255).astype(np.uint8)
+
+'''
+@input:
+    rgba - HxWx4 uint8 image
+@output:
+    HxWx3 uint8 image overlaid on a random background, as overlay_background.m
+'''
+def overlay_random_background(rgba):
+    cluttered_bkg_ratio = g_worker_state[2]
+    bgcrop = None
+    if np.random.rand() <= cluttered_bkg_ratio:
+        bgcrop = sample_background_crop(rgba.shape[0], rgba.shape[1])
+    if bgcrop is None:
+        bgcrop = np.random.rand() * 255
+    return blend_background(rgba, bgcrop)
+
+'''
+@input:
+    (src_image_file, dst_image_file)
+@output:
+    overlaid image saved to dst_image_file as jpg, returns an error message or None
+'''
+def overlay_one_image(src_dst):
+    src_image_file, dst_image_file = src_dst
+    try:
+        im = Image.open(src_image_file)
+        if im.mode != 'RGBA':
+            im = im.convert('RGBA')
+        rgba = np.asarray(im)
+    except (IOError, OSError):
+        return 'Failed to read %s' % (src_image_file)
+    if rgba.size == 0:
+        return 'Failed to overlay %s (empty image after crop)' % (src_image_file)
+    Image.fromarray(overlay_random_background(rgba)).save(os.path.splitext(dst_image_file)[0] + '.jpg')
+    return None
+
+'''
+@input:
+    src_folder - folder of cropped images, <src_folder>/*/*.png
+    dst_folder - overlaid images are saved with the same relative path, as .jpg
+    bkg_index_file - as written by build_background_index
+    bkg_folder - folder of background images
+    cluttered_bkg_ratio - ratio of images overlaid on a background image instead of a plain color
+    num_workers - number of processes, all cpus by default, 0 to overlay in this process
+    bkg_cache_folder - folder of the decoded background cache (e.g. in /dev/shm), None to disable it
+    bkg_cache_budget - maximum size of the cache in bytes
+'''
+def overlay_background(src_folder, dst_folder, bkg_index_file, bkg_folder, cluttered_bkg_ratio, num_workers=None, bkg_cache_folder=None, bkg_cache_budget=0):
+    bkg_index = load_background_index(bkg_index_file)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+
+    print('Start overlaying images at time %s, it takes for a while...' % (datetime.datetime.now().time()))
+    t_begin = time.time()
+    report_step = 10000
+    image_num = 0
+    failed_num = 0
+    initargs = (bkg_index, bkg_folder, cluttered_bkg_ratio, bkg_cache_folder, bkg_cache_budget)
+    if num_workers == 0:
+        init_overlay_worker(*initargs)
+        results = (overlay_one_image(x) for x in iter_image_files(src_folder, dst_folder))
+    else:
+        pool = multiprocessing.Pool(num_workers, initializer=init_overlay_worker, initargs=initargs)
+        results = pool.imap_unordered(overlay_one_image, iter_image_files(src_folder, dst_folder), chunksize=64)
+    for error in results:
+        image_num += 1
+        if error is not None:
+            failed_num += 1
+            print(error)
+        if image_num % report_step == 0:
+            print('[%s] %d images overlaid' % (datetime.datetime.now().time(), image_num))
+    if num_workers != 0:
+        pool.close()
+        pool.join()
+    print('%d images in total, %d failed.' % (image_num, failed_num))
+    print('%f seconds spent on background overlay!' % (time.time() - t_begin))
@@ -6,15 +6,21 @@ import sys
 import shutil
 import random
 import tempfile
+import time
 import datetime
-from functools import partial
+import json
+import threading
+import select
+from collections import namedtuple, OrderedDict
 from multiprocessing.dummy import Pool
-from subprocess import call
+from subprocess import call, Popen, PIPE
 import numpy as np
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
 sys.path.append(os.path.dirname(BASE_DIR))
 from global_variables import *
+from shape_catalog import load_one_category_shape_catalog, update_one_category_shape_catalog, fit_seconds_per_view, estimate_seconds_per_view
 
 '''
 @input: 
@@ -26,15 +32,45 @@ from global_variables import *
 '''
 def load_one_category_shape_list(shape_synset):
     # return a list of (synset, md5, numofviews) tuples
-    shape_md5_list = os.listdir(os.path.join(g_shapenet_root_folder,shape_synset))
-    n_models = len(shape_md5_list)
+    catalog = load_one_category_shape_catalog(shape_synset)
+    n_models = len(catalog)
     view_nums = np.bincount(np.random.choice(n_models, g_syn_images_num_per_category), minlength=n_models) 
     shape_list = []
     for i, view_num in enumerate(view_nums):
         if view_num != 0:
-	    shape_list.append((shape_synset, shape_md5_list[i], os.path.join(g_shapenet_root_folder, shape_synset, shape_md5_list[i], 'model.obj'), view_num))
+            shape_list.append((shape_synset, catalog[i].md5, catalog[i].shape_file, view_num))
     return shape_list
 
+'''
+@brief:
+    order render jobs longest first (estimated from the shape catalogs), so that
+    the most expensive shapes do not end up as stragglers at the end of a run
+'''
+def sort_render_jobs_by_cost(jobs):
+    catalogs = dict([(shape_synset, load_one_category_shape_catalog(shape_synset)) for shape_synset in set([job['shape_synset'] for job in jobs])])
+    # categories without enough timings are estimated from the timings of all categories
+    all_fit = fit_seconds_per_view([entry for catalog in catalogs.values() for entry in catalog])
+    seconds_per_view = {}
+    for shape_synset, catalog in catalogs.items():
+        seconds_per_view[shape_synset] = estimate_seconds_per_view(catalog, all_fit)
+    for job in jobs:
+        job['cost'] = job['view_num'] * seconds_per_view[job['shape_synset']].get(job['shape_md5'], 0)
+    return sorted(jobs, key=lambda job: job['cost'], reverse=True)
+
+'''
+@input:
+    jobs and their (success, seconds) results as returned by render_jobs_with_workers/commands
+@output:
+    measured seconds per view saved to the shape catalogs
+'''
+def update_shape_catalogs(jobs, results):
+    shape_seconds_per_view = {}
+    for job, (success, seconds) in zip(jobs, results):
+        if success:
+            shape_seconds_per_view.setdefault(job['shape_synset'], {})[job['shape_md5']] = seconds / job['view_num']
+    for shape_synset in shape_seconds_per_view:
+        update_one_category_shape_catalog(shape_synset, shape_seconds_per_view[shape_synset])
+
 '''
 @input: 
     shape synset
@@ -61,47 +97,327 @@ def load_one_category_shape_views(synset):
 
 '''
 @input:
-    shape_list and view_params as output of load_one_category_shape_list/views
+    shape synset
 @output:
-    save rendered images to g_syn_images_folder/<synset>/<md5>/xxx.png
-''' 
-def render_one_category_model_views(shape_list, view_params):
-    tmp_dirname = tempfile.mkdtemp(dir=g_data_folder, prefix='tmp_view_')
-    if not os.path.exists(tmp_dirname):
-        os.mkdir(tmp_dirname)
+    truncation parameters (left, right, top, bottom) sampled from the category's truncation
+    distribution, or from g_crop_proxy_category's if the category has none
+'''
+def load_one_category_truncation_params(synset):
+    truncation_file = g_truncation_distribution_files[synset]
+    if not os.path.exists(truncation_file):
+        print("No truncation file specified. Will use proxy truncation parameters instead")
+        truncation_file = os.path.join(g_truncation_distribution_folder, g_crop_proxy_category+'.txt')
+    return [[float(x) for x in line.split()] for line in open(truncation_file, 'r') if len(line.split()) == 4]
 
-    print('Generating rendering commands...')
-    commands = []
+'''
+@brief:
+    a render manifest lists every image of a category that should be rendered, one line per image:
+    "<synset> <md5> <shape_file> <azimuth> <elevation> <tilt> <distance> <image_file> <status>"
+    status is one of 'pending', 'done' or 'failed'. View parameters are sampled only once,
+    when the manifest is created, so an interrupted run can be resumed with the same views.
+'''
+RenderManifestEntry = namedtuple('RenderManifestEntry', ['synset', 'md5', 'shape_file', 'azimuth', 'elevation', 'tilt', 'distance', 'image_file', 'status'])
+
+def load_render_manifest(manifest_file):
+    entries = []
+    for line in open(manifest_file, 'r'):
+        ll = line.rstrip().split(' ')
+        entries.append(RenderManifestEntry(ll[0], ll[1], ll[2], float(ll[3]), float(ll[4]), float(ll[5]), float(ll[6]), ll[7], ll[8]))
+    return entries
+
+def write_render_manifest(manifest_file, entries):
+    tmp_manifest_file = manifest_file + '.tmp'
+    with open(tmp_manifest_file, 'w') as fout:
+        for entry in entries:
+            fout.write('%s %s %s %f %f %f %f %s %s\n' % tuple(entry))
+    os.rename(tmp_manifest_file, manifest_file)
+
+'''
+@input:
+    shape_list and view_params as output of load_one_category_shape_list/views
+@output:
+    manifest_file with one pending entry per image to render to g_syn_images_folder/<synset>/<md5>/xxx.png
+'''
+def create_one_category_render_manifest(shape_list, view_params, manifest_file):
+    entries = []
     for shape_synset, shape_md5, shape_file, view_num in shape_list:
-        # write tmp view file
-        tmp = tempfile.NamedTemporaryFile(dir=tmp_dirname, delete=False)
         for i in range(view_num):
-	    if len(view_params) != 0:
+            if len(view_params) != 0:
                 paramId = random.randint(0, len(view_params)-1)
-                tmp_string = '%f %f %f %f\n' % (view_params[paramId][0], view_params[paramId][1], view_params[paramId][2], max(0.01,view_params[paramId][3]))
+                azimuth, elevation, tilt, distance = view_params[paramId][0:4]
             else:
-	        azimuth = random.uniform(g_model_azimuth_degree_lowbound, g_model_azimuth_degree_highbound)
-		elevation = random.uniform(g_model_elevation_degree_lowbound, g_model_elevation_degree_highbound)
-		tilt = random.uniform(g_model_tilt_degree_lowbound, g_model_tilt_degree_highbound)
-		distance = random.uniform(g_model_dist_lowbound, g_model_dist_highbound)
-		tmp_string = '%f %f %f %f\n' % (azimuth, elevation, tilt, max(0.01,distance))
-	    tmp.write(tmp_string)
+                azimuth = random.uniform(g_model_azimuth_degree_lowbound, g_model_azimuth_degree_highbound)
+                elevation = random.uniform(g_model_elevation_degree_lowbound, g_model_elevation_degree_highbound)
+                tilt = random.uniform(g_model_tilt_degree_lowbound, g_model_tilt_degree_highbound)
+                distance = random.uniform(g_model_dist_lowbound, g_model_dist_highbound)
+            distance = max(0.01, distance)
+            # same naming as render_model_views.py, tilt is negated to match pascal3d annotations
+            # images cropped at render time go straight to the cropped images folder
+            image_file = os.path.join(g_syn_images_cropped_folder if g_syn_render_crop else g_syn_images_folder, shape_synset, shape_md5, '%s_%s_a%03d_e%03d_t%03d_d%03d.png' % \
+                (shape_synset, shape_md5, int(round(azimuth)), int(round(elevation)), int(round(-tilt)), int(round(distance))))
+            entries.append(RenderManifestEntry(shape_synset, shape_md5, shape_file, azimuth, elevation, tilt, distance, image_file, 'pending'))
+    write_render_manifest(manifest_file, entries)
+    return entries
+
+'''
+@brief:
+    check that a rendered png has been written completely (ends with the IEND chunk)
+'''
+def is_complete_png(image_file):
+    try:
+        with open(image_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < 12:
+                return False
+            f.seek(-12, os.SEEK_END)
+            return f.read()[4:8] == b'IEND'
+    except (IOError, OSError):
+        return False
+
+'''
+@input:
+    entries - manifest entries to be rendered
+    view_folder - folder where the view files of the jobs are written
+    crop - crop images at render time (truncation parameters are added to the view files)
+@output:
+    a list of render jobs (dicts as read by render_worker.py), one per shape
+'''
+def create_render_jobs(entries, view_folder, crop=g_syn_render_crop):
+    shape_entries = OrderedDict()
+    for entry in entries:
+        shape_entries.setdefault((entry.synset, entry.md5), []).append(entry)
+    truncation_params = {}
+    jobs = []
+    for (shape_synset, shape_md5), shape_view_entries in shape_entries.items():
+        if crop and shape_synset not in truncation_params:
+            truncation_params[shape_synset] = load_one_category_truncation_params(shape_synset)
+        # write tmp view file
+        tmp = tempfile.NamedTemporaryFile(mode='w', dir=view_folder, prefix='%s_%s_' % (shape_synset, shape_md5), delete=False)
+        for entry in shape_view_entries:
+            tmp_string = '%f %f %f %f %s' % (entry.azimuth, entry.elevation, entry.tilt, entry.distance, entry.image_file)
+            if crop:
+                # truncation parameters are sampled per image, as in crop_images.m
+                tmp_string += ' %f %f %f %f' % tuple(random.choice(truncation_params[shape_synset]))
+            tmp.write(tmp_string + '\n')
         tmp.close()
+        jobs.append({'shape_file': shape_view_entries[0].shape_file, 'shape_synset': shape_synset, 'shape_md5': shape_md5,
+                     'view_file': tmp.name, 'output_folder': os.path.dirname(shape_view_entries[0].image_file),
+                     'view_num': len(shape_view_entries)})
+    return jobs
 
-        command = '%s %s --background --python %s -- %s %s %s %s %s > /dev/null 2>&1' % (g_blender_executable_path, g_blank_blend_file_path, os.path.join(BASE_DIR, 'render_model_views.py'), shape_file, shape_synset, shape_md5, tmp.name, os.path.join(g_syn_images_folder, shape_synset, shape_md5))
-        commands.append(command)
-    print('done (%d commands)!'%(len(commands)))
-    print commands[0]
+'''
+@brief:
+    check that all images listed in the view file of a render job are complete
+'''
+def is_render_job_complete(job):
+    image_files = [line.rstrip().split(' ')[4] for line in open(job['view_file'], 'r')]
+    return all([is_complete_png(image_file) for image_file in image_files])
+
+'''
+@input:
+    manifest_file as created by create_one_category_render_manifest
+@output:
+    save rendered images to g_syn_images_folder/<synset>/<md5>/xxx.png
+    only entries whose image is missing or incomplete on disk are rendered,
+    statuses in manifest_file are updated afterwards
+'''
+def render_one_category_model_views(manifest_file):
+    entries = load_render_manifest(manifest_file)
+    entries = [entry._replace(status='done') if is_complete_png(entry.image_file) else entry for entry in entries]
+    todo_idxs = [k for k, entry in enumerate(entries) if entry.status != 'done']
+    print('%d of %d images already rendered, %d to go' % (len(entries)-len(todo_idxs), len(entries), len(todo_idxs)))
+    if len(todo_idxs) == 0:
+        write_render_manifest(manifest_file, entries)
+        return
+
+    tmp_dirname = tempfile.mkdtemp(dir=g_data_folder, prefix='tmp_view_')
+    if not os.path.exists(tmp_dirname):
+        os.mkdir(tmp_dirname)
+
+    print('Generating rendering jobs...')
+    jobs = sort_render_jobs_by_cost(create_render_jobs([entries[k] for k in todo_idxs], tmp_dirname))
+    print('done (%d jobs)!'%(len(jobs)))
 
     print('Rendering, it takes long time...')
-    report_step = 100
+    shape_synset = entries[0].synset
     if not os.path.exists(os.path.join(g_syn_images_folder, shape_synset)):
         os.mkdir(os.path.join(g_syn_images_folder, shape_synset))
+    if g_syn_rendering_use_worker_pool:
+        results = render_jobs_with_workers(jobs)
+    else:
+        results = render_jobs_with_commands(jobs)
+    update_shape_catalogs(jobs, results)
+    shutil.rmtree(tmp_dirname) 
+
+    for k in todo_idxs:
+        entries[k] = entries[k]._replace(status='done' if is_complete_png(entries[k].image_file) else 'failed')
+    write_render_manifest(manifest_file, entries)
+    print('%d images failed to render' % (len([entry for entry in entries if entry.status == 'failed'])))
+
+'''
+@brief:
+    one blender process per job, started from a shell command
+@output:
+    list of (success, seconds) in the order of jobs
+'''
+def render_jobs_with_commands(jobs):
+    commands = []
+    for job in jobs:
+        command = '%s %s --background --python %s -- %s %s %s %s %s > /dev/null 2>&1' % (g_blender_executable_path, g_blank_blend_file_path, os.path.join(BASE_DIR, 'render_model_views.py'), job['shape_file'], job['shape_synset'], job['shape_md5'], job['view_file'], job['output_folder'])
+        commands.append(command)
+    print commands[0]
+
+    def timed_call(command):
+        start_time = time.time()
+        return_code = call(command, shell=True)
+        return (return_code, time.time() - start_time)
+
+    report_step = 100
+    results = []
     pool = Pool(g_syn_rendering_thread_num)
-    for idx, return_code in enumerate(pool.imap(partial(call, shell=True), commands)):
+    for idx, (return_code, seconds) in enumerate(pool.imap(timed_call, commands)):
         if idx % report_step == 0:
-            print('[%s] Rendering command %d of %d' % (datetime.datetime.now().time(), idx, len(shape_list)))
+            print('[%s] Rendering command %d of %d' % (datetime.datetime.now().time(), idx, len(commands)))
         if return_code != 0:
-            print('Rendering command %d of %d (\"%s\") failed' % (idx, len(shape_list), commands[idx]))
-    shutil.rmtree(tmp_dirname) 
+            print('Rendering command %d of %d (\"%s\") failed' % (idx, len(commands), commands[idx]))
+        results.append((return_code == 0, seconds))
+    return results
+
+'''
+@brief:
+    a long-lived blender process running render_worker.py, jobs are sent through its stdin and
+    the worker reports each job on a dedicated status pipe (blender's own output goes to
+    /dev/null, so it can not be mistaken for a status). a job that takes longer than
+    g_syn_render_worker_timeout_base + g_syn_render_worker_timeout_per_view seconds per view
+    is failed and the process killed. the process is (re)started lazily, e.g. after it
+    crashed on a broken model.
+'''
+class RenderWorker(object):
+    def __init__(self):
+        self.process = None
+
+    def start(self):
+        self.devnull = open(os.devnull, 'w')
+        status_r, status_w = os.pipe()
+        env = dict(os.environ)
+        env['RENDER_WORKER_STATUS_FD'] = str(status_w)
+        # python 3 does not pass other file descriptors to the child by default
+        kwargs = {'pass_fds': (status_w,)} if sys.version_info[0] >= 3 else {}
+        self.process = Popen([g_blender_executable_path, g_blank_blend_file_path, '--background', '--python', os.path.join(BASE_DIR, 'render_worker.py')],
+                             stdin=PIPE, stdout=self.devnull, stderr=self.devnull, universal_newlines=True, env=env, **kwargs)
+        os.close(status_w)
+        self.status_fd = status_r
+        self.status_buffer = ''
+
+    '''
+    @output:
+        next status line of the worker without the newline, None if there is none within
+        timeout seconds or the worker died
+    '''
+    def read_status(self, timeout):
+        deadline = time.time() + timeout
+        while '\n' not in self.status_buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            # checked every few seconds, workers started in other threads may hold the write end too
+            ready, _, _ = select.select([self.status_fd], [], [], min(remaining, 5))
+            if not ready:
+                if self.process.poll() is not None:
+                    return None
+                continue
+            data = os.read(self.status_fd, 4096)
+            if not data:
+                return None
+            self.status_buffer += data.decode('ascii')
+        line, self.status_buffer = self.status_buffer.split('\n', 1)
+        return line
 
+    '''
+    @output:
+        (success, seconds spent on the job)
+    '''
+    def render(self, job):
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        start_time = time.time()
+        try:
+            self.process.stdin.write(json.dumps(job) + '\n')
+            self.process.stdin.flush()
+        except IOError:
+            self.stop()
+            return (False, 0)
+        timeout = g_syn_render_worker_timeout_base + g_syn_render_worker_timeout_per_view * job.get('view_num', 1)
+        line = self.read_status(timeout)
+        if line is None: # worker died or hangs in the middle of the job
+            if time.time() - start_time >= timeout:
+                print('Rendering %s timed out after %d seconds, restarting the worker' % (job['shape_file'], timeout))
+            self.kill()
+            return (False, time.time() - start_time)
+        _, status, seconds = line.split()
+        return (status == 'ok', float(seconds))
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.stop()
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write('\n')
+                self.process.stdin.close()
+            except IOError:
+                pass
+            self.process.wait()
+        self.devnull.close()
+        os.close(self.status_fd)
+        self.process = None
+
+'''
+@brief:
+    render jobs with g_syn_rendering_thread_num long-lived blender workers,
+    each dispatching thread owns one worker process.
+@output:
+    generator of (job_idx, success, seconds), in the order jobs finish
+'''
+def imap_render_jobs_with_workers(jobs):
+    local = threading.local()
+    workers = []
+    workers_lock = threading.Lock()
+
+    def render_job(job_idx):
+        if not hasattr(local, 'worker'):
+            local.worker = RenderWorker()
+            with workers_lock:
+                workers.append(local.worker)
+        return (job_idx,) + local.worker.render(jobs[job_idx])
+
+    pool = Pool(g_syn_rendering_thread_num)
+    try:
+        for result in pool.imap_unordered(render_job, range(len(jobs))):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+        for worker in workers:
+            worker.stop()
+
+'''
+@output:
+    list of (success, seconds) in the order of jobs, see imap_render_jobs_with_workers
+'''
+def render_jobs_with_workers(jobs):
+    report_step = 100
+    results = [None] * len(jobs)
+    for idx, (job_idx, success, seconds) in enumerate(imap_render_jobs_with_workers(jobs)):
+        if idx % report_step == 0:
+            print('[%s] Rendering job %d of %d' % (datetime.datetime.now().time(), idx, len(jobs)))
+        if not success:
+            print('Rendering job %d of %d (%s) failed' % (job_idx, len(jobs), jobs[job_idx]['shape_file']))
+        results[job_idx] = (success, seconds)
+    return results
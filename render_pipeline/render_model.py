@@ -14,6 +14,22 @@ inputs:
        <shape_view_params_file>: txt file - each line is '<azimith angle> <elevation angle> <in-plane rotation angle> <distance>'
        <syn_img_output_folder>: output folder path for rendered images of this model
 
+options (after the positional arguments of render_model.py):
+       --visibility raycast|zbuffer: keypoint occlusion by ray casting against the mesh (default), or by
+                                     comparing keypoint depths with the rendered z pass, which is then
+                                     saved next to each image as <image>_depth.npy
+       --depth_threshold: relative depth tolerance of the zbuffer mode
+       --label_store <file.npz>: write the keypoints of all views to one file (see keypoint_store.py),
+                                 the label files of the view parameter file are then not written
+       --lod: render decimated versions of the mesh when it looks small (see scene_utils.LODShape),
+              keypoints are still computed on the full mesh. not allowed with --visibility zbuffer,
+              the depth pass would come from the decimated mesh
+       --bbox_sidecar: read each render back to add its object bounding box to the sidecar of the image folder
+                       (see bbox_sidecar.py), on by default with g_syn_render_bbox_sidecar. z-buffer renders
+                       always get a bbox. with --lod the level of detail is added to a sidecar as well
+       --seed, --view_offset: seed the lighting of each view with seed + view_offset + view index,
+                              so that a view list split in several parts renders the same
+
 author: hao su, charles r. qi, yangyan li
 '''
 
@@ -21,25 +37,21 @@ import os
 import bpy
 import sys
 import random
+import argparse
 import numpy as np
 import bpy
-from bpy_extras.object_utils import world_to_camera_view
 import bmesh
 from mathutils import Vector, Matrix
-from mathutils.geometry import intersect_ray_tri
 import math
-from collections import OrderedDict
 
 # Load rendering light parameters
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(BASE_DIR))
 from global_variables import *
 from render_pipeline.blender_utils import *
-
-light_num_lowbound = g_syn_light_num_lowbound
-light_num_highbound = g_syn_light_num_highbound
-light_dist_lowbound = g_syn_light_dist_lowbound
-light_dist_highbound = g_syn_light_dist_highbound
+from render_pipeline.scene_utils import *
+from render_pipeline.keypoint_utils import *
+from render_pipeline.keypoint_store import *
 
 render_scale = bpy.context.scene.render.resolution_percentage / 100
 render_size = (
@@ -47,20 +59,32 @@ render_size = (
             int(bpy.context.scene.render.resolution_y * render_scale),
             )
 
-def project_by_object_utils(cam, point):
-    scene = bpy.context.scene
-    co_2d = world_to_camera_view(scene, cam, point)
-    return Vector((co_2d.x * render_size[0], render_size[1] - co_2d.y * render_size[1]))
-
 # Input parameters
 #'%s %s --background --python %s -- %s %s %s %s %s %s' % (g_blender_executable_path, blank_file, render_code, args.model_file, 'xxx', 'xxx', view_file, temp_dirname, args.scale)
-shape_file = sys.argv[-6]
-keypoint_file = sys.argv[-5]
+parser = argparse.ArgumentParser(description='Render views of a model with 2d keypoint labels')
+parser.add_argument('shape_file')
+parser.add_argument('keypoint_file')
+parser.add_argument('shape_md5')
+parser.add_argument('shape_view_params_file')
+parser.add_argument('syn_images_folder')
+parser.add_argument('scale', type=float)
+parser.add_argument('--visibility', choices=['raycast', 'zbuffer'], default='raycast', help='keypoint occlusion test')
+parser.add_argument('--depth_threshold', type=float, default=0.01, help='relative depth tolerance of the zbuffer test')
+parser.add_argument('--seed', type=int, default=None, help='random seed of the lighting')
+parser.add_argument('--view_offset', type=int, default=0, help='index of the first view in the whole view list, for seeding')
+parser.add_argument('--bbox_sidecar', action='store_true', default=g_syn_render_bbox_sidecar, help='write object bounding boxes of the renders to sidecars')
+parser.add_argument('--lod', action='store_true', help='render decimated meshes for small projections')
+parser.add_argument('--label_store', default=None, help='write all keypoint labels to this .npz file instead of one txt file per view')
+args = parser.parse_args(sys.argv[sys.argv.index('--')+1:])
+if args.lod and args.visibility == 'zbuffer':
+    parser.error('--lod can not be used with --visibility zbuffer (keypoint depths are of the full mesh)')
+shape_file = args.shape_file
+keypoint_file = args.keypoint_file
 #shape_synset = sys.argv[-5]
-shape_md5 = sys.argv[-4]
-shape_view_params_file = sys.argv[-3]
-syn_images_folder = sys.argv[-2]
-scale = float(sys.argv[-1])
+shape_md5 = args.shape_md5
+shape_view_params_file = args.shape_view_params_file
+syn_images_folder = args.syn_images_folder
+scale = args.scale
 
 if not os.path.exists(syn_images_folder):
     os.mkdir(syn_images_folder)
@@ -70,13 +94,7 @@ view_params = [[float(x) if i < 4 else x for i,x in enumerate(line.strip().split
 if not os.path.exists(syn_images_folder):
     os.makedirs(syn_images_folder)
 
-if shape_file[-3:] == 'ply':
-    bpy.ops.import_mesh.ply(filepath=shape_file)
-    bpy.ops.transform.resize(value=(scale, scale, scale))
-elif shape_file[-3:] == 'dae':
-    bpy.ops.wm.collada_import(filepath=shape_file)
-elif shape_file[-3:] == 'obj':
-    bpy.ops.import_scene.obj(filepath=shape_file)
+import_shape(shape_file, scale)
 
 scene = bpy.context.scene
 #obj = bpy.data.meshes[shape_file.split('/')[-1][:-4]]
@@ -112,53 +130,61 @@ bpy.ops.object.join()
 # Find mesh name
 mesh_name = [x.name for x in bpy.data.objects if x.name not in ['Camera','Lamp']][0]
 
-# Push all vertices in a dict
-vert_visibility_dict = {}
+# Keypoints index the sorted list of distinct vertex coordinates, label files have one line per entry
 obj = bpy.data.objects[mesh_name]
 verts = [obj.matrix_world*vert.co for vert in obj.data.vertices]
-for vert in verts:
-    vert_str = "{:.40f},{:.40f},{:.40f}".format(vert[0],vert[1], vert[2]) 
-    vert_visibility_dict[vert_str] = (False, None)
-vert_visibility_dict = OrderedDict(sorted(vert_visibility_dict.items(), key=lambda x: x[0]))
+vert_strs = ["{:.40f},{:.40f},{:.40f}".format(vert[0],vert[1], vert[2]) for vert in verts]
+vert_str_list = sorted(set(vert_strs))
+# occluding triangles are put in a BVH tree once, the mesh does not move between views
+if args.visibility == 'raycast':
+    vis_tester = VisibilityTester(verts, [polygon.vertices[:] for polygon in obj.data.polygons])
+else:
+    enable_depth_viewer_node()
 # set lights
 bpy.ops.object.select_all(action='TOGGLE')
 if 'Lamp' in list(bpy.data.objects.keys()):
     bpy.data.objects['Lamp'].select = True # remove default light
 bpy.ops.object.delete()
+light_rig = LightRig()
 
 # YOUR CODE START HERE
 with open(keypoint_file) as f:
     kp_list =  [int(x.strip()) for x in f.readlines()]
 
-for param in view_params:
+# keypoint index -> vertex index, the last vertex wins when several share the coordinates
+vert_str_idxs = dict([(vert_str, k) for k, vert_str in enumerate(vert_str_list)])
+kp_set = set(kp_list)
+kp_vert_idx_dict = {}
+for i, vert_str in enumerate(vert_strs):
+    if vert_str_idxs[vert_str] in kp_set:
+        kp_vert_idx_dict[vert_str_idxs[vert_str]] = i
+kp_idxs = sorted(kp_vert_idx_dict.keys())
+kp_vert_idxs = [kp_vert_idx_dict[k] for k in kp_idxs]
+kp_coords = np.array([tuple(verts[i]) for i in kp_vert_idxs]).reshape(-1, 3)
+
+if args.label_store is not None:
+    kp_store = np.full((len(view_params), len(kp_idxs), 2), -1, dtype=np.int16)
+
+# camera poses of all views are computed at once, the loop below only assigns them
+cam_locations, cam_quaternions = batch_camera_poses([param[0:4] for param in view_params])
+sidecar_bboxes = {}
+sidecar_lods = {}
+if args.lod:
+    lod_shape = LODShape()
+for view_idx, param in enumerate(view_params):
     azimuth_deg = param[0]
     elevation_deg = param[1]
     theta_deg = -1 * param[2] # ** multiply by -1 to match pascal3d annotations **
     rho = param[3]
     img_file = param[4]
     lbl_file = param[5]
-    # clear default lights
-    bpy.ops.object.select_by_type(type='LAMP')
-    bpy.ops.object.delete(use_global=False)
-
-    # set environment lighting
-    #bpy.context.space_data.context = 'WORLD'
-    bpy.context.scene.world.light_settings.use_environment_light = True
-    bpy.context.scene.world.light_settings.environment_energy = np.random.uniform(g_syn_light_environment_energy_lowbound, g_syn_light_environment_energy_highbound)
-    bpy.context.scene.world.light_settings.environment_color = 'PLAIN'
-    # set point lights
-    for i in range(random.randint(light_num_lowbound,light_num_highbound)):
-        light_azimuth_deg = np.random.uniform(g_syn_light_azimuth_degree_lowbound, g_syn_light_azimuth_degree_highbound)
-        light_elevation_deg  = np.random.uniform(g_syn_light_elevation_degree_lowbound, g_syn_light_elevation_degree_highbound)
-        light_dist = np.random.uniform(light_dist_lowbound, light_dist_highbound)
-        lx, ly, lz = obj_centened_camera_pos(light_dist, light_azimuth_deg, light_elevation_deg)
-        bpy.ops.object.lamp_add(type='POINT', view_align = False, location=(lx, ly, lz))
-        bpy.data.objects['Point'].data.energy = np.random.normal(g_syn_light_energy_mean, g_syn_light_energy_std)
-    
-    cx, cy, cz = obj_centened_camera_pos(rho, azimuth_deg, elevation_deg)
-    q1 = camPosToQuaternion(cx, cy, cz)
-    q2 = camRotQuaternion(cx, cy, cz, theta_deg)
-    q = quaternionProduct(q2, q1)
+    if args.seed is not None:
+        random.seed(args.seed + args.view_offset + view_idx)
+        np.random.seed((args.seed + args.view_offset + view_idx) % (2**32))
+    set_random_lighting(light_rig)
+
+    cx, cy, cz = cam_locations[view_idx]
+    q = cam_quaternions[view_idx]
     camObj.location[0] = cx
     camObj.location[1] = cy 
     camObj.location[2] = cz
@@ -168,62 +194,52 @@ for param in view_params:
     camObj.rotation_quaternion[2] = q[2]
     camObj.rotation_quaternion[3] = q[3]
     bpy.context.scene.update()
-    vert_list_from_dict = list(vert_visibility_dict.keys())
-    # use generator expressions () or list comprehensions []
-    for obj in [bpy.data.objects[mesh_name]]:
-        coords_2d = [project_by_object_utils(camObj, coord) for coord in verts]
-        eye_location = camObj.location 
-        # Find visible points in current camera
-        vert_indices = []
-        for polygon in obj.data.polygons:
-            vert_index = [p for p in polygon.vertices]
-            vert_indices.append(vert_index)
-        random.shuffle(vert_indices)
-        for i, vert in enumerate(verts):
-            vert_str = "{:.40f},{:.40f},{:.40f}".format(vert[0],vert[1], vert[2])
-            if vert_list_from_dict.index(vert_str) not in kp_list:
-                continue
-            vis = True
-            for vert_index in vert_indices:
-                if i in vert_index:
-                    continue
-                v1 = Vector(verts[vert_index[0]])
-                v2 = Vector(verts[vert_index[1]])
-                v3 = Vector(verts[vert_index[2]])
-                ray = Vector(eye_location-vert)
-                orig = Vector(vert)
-                
-                int_pt = intersect_ray_tri(v1, v2, v3, ray, orig)
-                if int_pt != None:
-                    vis = False
-                    break
-            
-            if vis:    
-                vert_visibility_dict[vert_str] = (True, coords_2d[i])
-            else:
-                vert_visibility_dict[vert_str] = (False, coords_2d[i])
-        
-        # 2d data printout:
-        rnd = lambda i: round(i)
-        #syn_label_file = 'syn_a%03d_e%03d_t%03d_d%03d.txt' % (round(azimuth_deg), round(elevation_deg), round(theta_deg), round(rho))
-        render_scale = bpy.context.scene.render.resolution_percentage / 100
-        render_size = (
-            int(bpy.context.scene.render.resolution_x * render_scale),
-            int(bpy.context.scene.render.resolution_y * render_scale),
-            )
+    if args.lod:
+        sidecar_lods.setdefault(os.path.dirname(img_file), {})[os.path.basename(img_file)] = list(lod_shape.select(camObj))
+    if args.visibility == 'zbuffer':
+        bpy.data.scenes['Scene'].render.filepath = os.path.join(img_file)
+        bpy.ops.render.render( write_still=True )
+        depth_buffer = get_viewer_depth()
+        np.save(os.path.splitext(img_file)[0] + '_depth.npy', depth_buffer)
+        # the background is at depth 1e10
+        bbox = get_alpha_bbox((depth_buffer < 1e9).astype(np.uint8))
+    elif args.bbox_sidecar:
+        bbox = render_with_bbox(img_file)
+    else:
+        render_still(img_file)
+        bbox = None
+    if bbox is not None:
+        sidecar_bboxes.setdefault(os.path.dirname(img_file), {})[os.path.basename(img_file)] = bbox_sidecar_line(bbox)
+
+    # only keypoints are projected and tested
+    kp_coords_2d = project_points(camera_projection_matrix(scene, camObj, render_size), kp_coords, render_size)
+    if args.visibility == 'zbuffer':
+        kp_zbuffer_visible = zbuffer_visibility(kp_coords_2d, camera_depths(camObj, kp_coords), depth_buffer, args.depth_threshold)
+    eye_location = camObj.location 
+    key_pxs = [(-1, -1)] * len(vert_str_list)
+    for kp, (k, i, (x, y)) in enumerate(zip(kp_idxs, kp_vert_idxs, kp_coords_2d)):
+        x, y = float(x), float(y)
+        if not ((0 <= x < render_size[0]) and (0 <= y < render_size[1])):
+            continue
+        if args.visibility == 'zbuffer':
+            vis = kp_zbuffer_visible[kp]
+        else:
+            vis = vis_tester.is_visible(i, eye_location)
+        if vis:
+            key_pxs[k] = (round(x), round(y))
+
+    # 2d data printout:
+    #syn_label_file = 'syn_a%03d_e%03d_t%03d_d%03d.txt' % (round(azimuth_deg), round(elevation_deg), round(theta_deg), round(rho))
+    if args.label_store is not None:
+        kp_store[view_idx] = [key_pxs[k] for k in kp_idxs]
+    else:
         with open(lbl_file, 'w') as f:
-             for i, vert in enumerate(vert_visibility_dict.items()):
-                if vert[1][1] == None:
-                    key_px = "{} {} {}".format(i, -1, -1)
-                else:
-                    x, y = vert[1][1]
-        #        key_px = "{} {} {}".format(i, rnd(x), rnd(y))
-                    if vert[1][0] and (0 <= x < render_size[0]) and (0 <= y < render_size[1]):
-                        key_px = "{} {} {}".format(i, rnd(x), rnd(y))
-                    else:
-                        key_px = "{} {} {}".format(i, -1, -1)
-                f.write("%s\n"%key_px)
-    #syn_image_file = 'syn_a%03d_e%03d_t%03d_d%03d.png' % (round(azimuth_deg), round(elevation_deg), round(theta_deg), round(rho))
-    bpy.data.scenes['Scene'].render.filepath = os.path.join(img_file)
-    bpy.ops.render.render( write_still=True )
-
+            for k, (x, y) in enumerate(key_pxs):
+                f.write("{} {} {}\n".format(k, x, y))
+
+for folder, bboxes in sidecar_bboxes.items():
+    update_bbox_sidecar(folder, bboxes)
+for folder, lods in sidecar_lods.items():
+    update_bbox_sidecar(folder, lods, g_syn_lod_sidecar_filename)
+if args.label_store is not None:
+    write_keypoint_store(args.label_store, [param[0:4] for param in view_params], [param[4] for param in view_params], kp_idxs, kp_store, len(vert_str_list))
@@ -11,7 +11,7 @@ inputs:
        <shape_obj_filename>: .obj file of the 3D shape model
        <shape_category_synset>: synset string like '03001627' (chairs)
        <shape_model_md5>: md5 (as an ID) of the 3D shape model
-       <shape_view_params_file>: txt file - each line is '<azimith angle> <elevation angle> <in-plane rotation angle> <distance>'
+       <shape_view_params_file>: txt file - each line is '<azimith angle> <elevation angle> <in-plane rotation angle> <distance> [<output image file> [<truncation parameter (4 values)>]]'
        <syn_img_output_folder>: output folder path for rendered images of this model
 
 author: hao su, charles r. qi, yangyan li
@@ -20,97 +20,118 @@ author: hao su, charles r. qi, yangyan li
 import os
 import bpy
 import sys
-import random
-import numpy as np
 
 # Load rendering light parameters
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(BASE_DIR))
 from global_variables import *
 from render_pipeline.blender_utils import *
+from render_pipeline.scene_utils import *
 
-light_num_lowbound = g_syn_light_num_lowbound
-light_num_highbound = g_syn_light_num_highbound
-light_dist_lowbound = g_syn_light_dist_lowbound
-light_dist_highbound = g_syn_light_dist_highbound
-
-# Input parameters
-shape_file = sys.argv[-5]
-shape_synset = sys.argv[-4]
-shape_md5 = sys.argv[-3]
-shape_view_params_file = sys.argv[-2]
-syn_images_folder = sys.argv[-1]
-if not os.path.exists(syn_images_folder):
-    os.mkdir(syn_images_folder)
-#syn_images_folder = os.path.join(g_syn_images_folder, shape_synset, shape_md5) 
-view_params = [[float(x) for x in line.strip().split(' ')] for line in open(shape_view_params_file).readlines()]
-
-if not os.path.exists(syn_images_folder):
-    os.makedirs(syn_images_folder)
-
-if shape_file[-3:] == 'obj':
-    bpy.ops.import_scene.obj(filepath=shape_file) 
-elif shape_file[-3:] == 'ply':
-    bpy.ops.import_mesh.ply(filepath=shape_file)
-    bpy.ops.transform.resize(value=(0.001, 0.001, 0.001))
-
-bpy.context.scene.render.alpha_mode = 'TRANSPARENT'
-#bpy.context.scene.render.use_shadows = False
-#bpy.context.scene.render.use_raytrace = False
-
-bpy.data.objects['Lamp'].data.energy = 0
-
-#m.subsurface_scattering.use = True
-
-camObj = bpy.data.objects['Camera']
-# camObj.data.lens_unit = 'FOV'
-# camObj.data.angle = 0.2
-
-# set lights
-bpy.ops.object.select_all(action='TOGGLE')
-if 'Lamp' in list(bpy.data.objects.keys()):
-    bpy.data.objects['Lamp'].select = True # remove default light
-bpy.ops.object.delete()
-
-# YOUR CODE START HERE
-
-for param in view_params:
-    azimuth_deg = param[0]
-    elevation_deg = param[1]
-    theta_deg = -1 * param[2] # ** multiply by -1 to match pascal3d annotations **
-    rho = param[3]
-
-    # clear default lights
-    bpy.ops.object.select_by_type(type='LAMP')
-    bpy.ops.object.delete(use_global=False)
-
-    # set environment lighting
-    #bpy.context.space_data.context = 'WORLD'
-    bpy.context.scene.world.light_settings.use_environment_light = True
-    bpy.context.scene.world.light_settings.environment_energy = np.random.uniform(g_syn_light_environment_energy_lowbound, g_syn_light_environment_energy_highbound)
-    bpy.context.scene.world.light_settings.environment_color = 'PLAIN'
-    # set point lights
-    for i in range(random.randint(light_num_lowbound,light_num_highbound)):
-        light_azimuth_deg = np.random.uniform(g_syn_light_azimuth_degree_lowbound, g_syn_light_azimuth_degree_highbound)
-        light_elevation_deg  = np.random.uniform(g_syn_light_elevation_degree_lowbound, g_syn_light_elevation_degree_highbound)
-        light_dist = np.random.uniform(light_dist_lowbound, light_dist_highbound)
-        lx, ly, lz = obj_centened_camera_pos(light_dist, light_azimuth_deg, light_elevation_deg)
-        bpy.ops.object.lamp_add(type='POINT', view_align = False, location=(lx, ly, lz))
-        bpy.data.objects['Point'].data.energy = np.random.normal(g_syn_light_energy_mean, g_syn_light_energy_std)
-    
-    cx, cy, cz = obj_centened_camera_pos(rho, azimuth_deg, elevation_deg)
-    q1 = camPosToQuaternion(cx, cy, cz)
-    q2 = camRotQuaternion(cx, cy, cz, theta_deg)
-    q = quaternionProduct(q2, q1)
-    camObj.location[0] = cx
-    camObj.location[1] = cy 
-    camObj.location[2] = cz
-    camObj.rotation_mode = 'QUATERNION'
-    camObj.rotation_quaternion[0] = q[0]
-    camObj.rotation_quaternion[1] = q[1]
-    camObj.rotation_quaternion[2] = q[2]
-    camObj.rotation_quaternion[3] = q[3]
-    syn_image_file = './%s_%s_a%03d_e%03d_t%03d_d%03d.png' % (shape_synset, shape_md5, round(azimuth_deg), round(elevation_deg), round(theta_deg), round(rho))
-    bpy.data.scenes['Scene'].render.filepath = os.path.join(syn_images_folder, syn_image_file)
-    bpy.ops.render.render( write_still=True )
+'''
+@brief:
+    one-time scene setup (transparent background, default lamp replaced by a LightRig)
+@output:
+    the LightRig
+'''
+def setup_scene():
+    bpy.context.scene.render.alpha_mode = 'TRANSPARENT'
+    #bpy.context.scene.render.use_shadows = False
+    #bpy.context.scene.render.use_raytrace = False
+
+    if 'Lamp' in list(bpy.data.objects.keys()):
+        bpy.data.objects['Lamp'].data.energy = 0
+
+    #m.subsurface_scattering.use = True
 
+    # set lights
+    bpy.ops.object.select_all(action='DESELECT')
+    if 'Lamp' in list(bpy.data.objects.keys()):
+        bpy.data.objects['Lamp'].select = True # remove default light
+    bpy.ops.object.delete()
+    return LightRig()
+
+'''
+@input:
+    view_params - list of [azimuth, elevation, tilt, distance], optionally followed by image_file
+                  and the 4 values of a truncation parameter to crop the image at render time
+    light_rig - LightRig as returned by setup_scene
+@output:
+    rendered images saved to syn_images_folder, shape is assumed to be imported already.
+    object bounding boxes of cropped images (and of all images with g_syn_render_bbox_sidecar) are
+    added to the bbox sidecar of syn_images_folder (see bbox_sidecar.py)
+    with g_syn_render_lod, the level of detail of each image is recorded the same way
+'''
+def render_views(shape_synset, shape_md5, view_params, syn_images_folder, light_rig):
+    if not os.path.exists(syn_images_folder):
+        os.makedirs(syn_images_folder)
+
+    camObj = bpy.data.objects['Camera']
+    # camObj.data.lens_unit = 'FOV'
+    # camObj.data.angle = 0.2
+
+    # camera poses of all views are computed at once, the loop below only assigns them
+    cam_locations, cam_quaternions = batch_camera_poses([param[0:4] for param in view_params])
+    sidecar_bboxes = {}
+    sidecar_lods = {}
+    if g_syn_render_lod:
+        lod_shape = LODShape()
+    for view_idx, param in enumerate(view_params):
+        azimuth_deg = param[0]
+        elevation_deg = param[1]
+        theta_deg = -1 * param[2] # ** multiply by -1 to match pascal3d annotations **
+        rho = param[3]
+
+        set_random_lighting(light_rig)
+
+        cx, cy, cz = cam_locations[view_idx]
+        q = cam_quaternions[view_idx]
+        camObj.location[0] = cx
+        camObj.location[1] = cy 
+        camObj.location[2] = cz
+        camObj.rotation_mode = 'QUATERNION'
+        camObj.rotation_quaternion[0] = q[0]
+        camObj.rotation_quaternion[1] = q[1]
+        camObj.rotation_quaternion[2] = q[2]
+        camObj.rotation_quaternion[3] = q[3]
+        if g_syn_render_lod:
+            lod_level, lod_face_num = lod_shape.select(camObj)
+        if len(param) > 4:
+            syn_image_file = param[4]
+        else:
+            syn_image_file = './%s_%s_a%03d_e%03d_t%03d_d%03d.png' % (shape_synset, shape_md5, round(azimuth_deg), round(elevation_deg), round(theta_deg), round(rho))
+        if len(param) > 5:
+            # crop at render time, the full frame is never written
+            truncation_param = [float(x) for x in param[5:9]]
+            boxes = render_cropped(os.path.join(syn_images_folder, syn_image_file), truncation_param)
+            if boxes is None:
+                print('Failed to crop %s (empty image after crop)' % (syn_image_file))
+            elif boxes[0] is not None:
+                sidecar_bboxes[os.path.basename(syn_image_file)] = bbox_sidecar_line(boxes[0], boxes[1])
+        elif g_syn_render_bbox_sidecar:
+            bbox = render_with_bbox(os.path.join(syn_images_folder, syn_image_file))
+            if bbox is not None:
+                sidecar_bboxes[os.path.basename(syn_image_file)] = bbox_sidecar_line(bbox)
+        else:
+            render_still(os.path.join(syn_images_folder, syn_image_file))
+        if g_syn_render_lod:
+            sidecar_lods[os.path.basename(syn_image_file)] = [lod_level, lod_face_num]
+    update_bbox_sidecar(syn_images_folder, sidecar_bboxes)
+    update_bbox_sidecar(syn_images_folder, sidecar_lods, g_syn_lod_sidecar_filename)
+
+def load_view_params(shape_view_params_file):
+    return [[float(x) if i < 4 else x for i,x in enumerate(line.strip().split(' '))] for line in open(shape_view_params_file).readlines()]
+
+if __name__ == '__main__':
+    # Input parameters
+    shape_file = sys.argv[-5]
+    shape_synset = sys.argv[-4]
+    shape_md5 = sys.argv[-3]
+    shape_view_params_file = sys.argv[-2]
+    syn_images_folder = sys.argv[-1]
+    #syn_images_folder = os.path.join(g_syn_images_folder, shape_synset, shape_md5) 
+    view_params = load_view_params(shape_view_params_file)
+
+    import_shape(shape_file)
+    light_rig = setup_scene()
+    render_views(shape_synset, shape_md5, view_params, syn_images_folder, light_rig)
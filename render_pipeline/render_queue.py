@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+RENDER_QUEUE.py
+brief:
+	shared render job queue (one job per shape) stored in a sqlite database on a filesystem
+	visible to all render servers. Servers pull jobs as long as there are any left instead
+	of rendering a fixed set of categories, so fast servers simply end up rendering more shapes.
+	note: the filesystem has to support posix file locks (e.g. NFSv4 with locking enabled).
+'''
+
+import os
+import sys
+import time
+import json
+import sqlite3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+
+class RenderQueue(object):
+    def __init__(self, queue_file):
+        self.queue_file = queue_file
+        self.conn = sqlite3.connect(queue_file, timeout=600, isolation_level=None)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 job TEXT NOT NULL,
+                                 status TEXT NOT NULL DEFAULT 'pending',
+                                 hostname TEXT,
+                                 claimed_time REAL,
+                                 attempts INTEGER NOT NULL DEFAULT 0,
+                                 seconds REAL)''')
+
+    '''
+    @input:
+        jobs - render jobs as created by render_helper.create_render_jobs
+    '''
+    def add_jobs(self, jobs):
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany('INSERT INTO jobs (job) VALUES (?)', [(json.dumps(job),) for job in jobs])
+        self.conn.execute('COMMIT')
+
+    '''
+    @brief:
+        atomically take the next pending job. Jobs claimed more than g_syn_render_queue_claim_timeout
+        seconds ago are considered lost (e.g. the server died) and are handed out again, or marked
+        'failed' if they used up g_syn_render_queue_max_attempts.
+    @output:
+        (job_id, job, claimed_time) or None if no job can be claimed now (see running_job_count).
+        hostname and claimed_time identify the claim in renew_claim and finish_job
+    '''
+    def claim_job(self, hostname):
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('''UPDATE jobs SET status = 'failed'
+                                 WHERE status = 'running' AND claimed_time < ? AND attempts >= ?''',
+                              (now - g_syn_render_queue_claim_timeout, g_syn_render_queue_max_attempts))
+            row = self.conn.execute('''SELECT id, job FROM jobs
+                                       WHERE attempts < ? AND (status = 'pending' OR (status = 'running' AND claimed_time < ?))
+                                       ORDER BY id LIMIT 1''',
+                                    (g_syn_render_queue_max_attempts, now - g_syn_render_queue_claim_timeout)).fetchone()
+            if row is not None:
+                self.conn.execute('''UPDATE jobs SET status = 'running', hostname = ?, claimed_time = ?, attempts = attempts + 1
+                                     WHERE id = ?''', (hostname, now, row[0]))
+            self.conn.execute('COMMIT')
+        except:
+            self.conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return (row[0], json.loads(row[1]), now)
+
+    '''
+    @brief:
+        move the claim of a running job forward, so that it does not expire while the job is
+        still rendering (call it well within g_syn_render_queue_claim_timeout)
+    @output:
+        the new claimed_time, None if the claim was lost (the job was handed out again)
+    '''
+    def renew_claim(self, job_id, hostname, claimed_time):
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        cursor = self.conn.execute('''UPDATE jobs SET claimed_time = ?
+                                      WHERE id = ? AND status = 'running' AND hostname = ? AND claimed_time = ?''',
+                                   (now, job_id, hostname, claimed_time))
+        self.conn.execute('COMMIT')
+        return now if cursor.rowcount == 1 else None
+
+    '''
+    @brief:
+        failed jobs go back to pending until they used up g_syn_render_queue_max_attempts
+    @output:
+        False if the claim was lost (the job was handed out again), the job is then left as is
+    '''
+    def finish_job(self, job_id, hostname, claimed_time, success, seconds):
+        status = 'done' if success else 'pending'
+        self.conn.execute('BEGIN IMMEDIATE')
+        cursor = self.conn.execute('''UPDATE jobs SET status = CASE WHEN ? = 'pending' AND attempts >= ? THEN 'failed' ELSE ? END,
+                                          seconds = ?
+                                      WHERE id = ? AND status = 'running' AND hostname = ? AND claimed_time = ?''',
+                                   (status, g_syn_render_queue_max_attempts, status, seconds, job_id, hostname, claimed_time))
+        self.conn.execute('COMMIT')
+        return cursor.rowcount == 1
+
+    '''
+    @output:
+        number of jobs claimed by some server and not finished yet. they are handed out again
+        (or marked 'failed') by claim_job once their claim has expired
+    '''
+    def running_job_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+
+    '''
+    @output:
+        (jobs, results) of all finished jobs, results are (True, seconds) as expected by
+        render_helper.update_shape_catalogs
+    '''
+    def finished_jobs(self):
+        rows = self.conn.execute("SELECT job, seconds FROM jobs WHERE status = 'done' ORDER BY id").fetchall()
+        return ([json.loads(row[0]) for row in rows], [(True, row[1]) for row in rows])
+
+    '''
+    @output:
+        dict of status -> number of jobs
+    '''
+    def status_counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def close(self):
+        self.conn.close()
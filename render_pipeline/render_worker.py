@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+RENDER_WORKER.py
+brief:
+	long-lived rendering worker. Instead of starting one blender process per shape,
+	the worker reads render jobs from stdin (one json object per line), renders them
+	one after another and clears the scene between shapes.
+usage:
+	blender blank.blend --background --python render_worker.py
+
+inputs (stdin, one job per line):
+       {"shape_file": <.obj file>, "shape_synset": <synset>, "shape_md5": <md5>,
+        "view_file": <shape_view_param_file>, "output_folder": <syn_img_output_folder>,
+        "png_compression": <optional 0-100, e.g. 0 for images that are read back right away>}
+       an empty line or EOF stops the worker.
+
+outputs (file descriptor RENDER_WORKER_STATUS_FD of the environment, stdout if it is not set):
+       '<g_render_worker_done_tag> <ok|failed> <seconds>' after each job. Nothing else is written
+       there, blender's own output stays on stdout.
+'''
+
+import os
+import bpy
+import sys
+import json
+import time
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_pipeline.scene_utils import *
+from render_pipeline.render_model_views import setup_scene, render_views, load_view_params
+
+def render_job(job, light_rig):
+    if 'png_compression' in job:
+        bpy.context.scene.render.image_settings.compression = job['png_compression']
+    clear_shapes()
+    import_shape(job['shape_file'])
+    view_params = load_view_params(job['view_file'])
+    render_views(job['shape_synset'], job['shape_md5'], view_params, job['output_folder'], light_rig)
+
+if __name__ == '__main__':
+    if 'RENDER_WORKER_STATUS_FD' in os.environ:
+        status_out = os.fdopen(int(os.environ['RENDER_WORKER_STATUS_FD']), 'w')
+    else:
+        status_out = sys.stdout
+    light_rig = setup_scene()
+    while True:
+        line = sys.stdin.readline()
+        if not line.strip():
+            break
+        start_time = time.time()
+        try:
+            render_job(json.loads(line), light_rig)
+            status = 'ok'
+        except Exception:
+            traceback.print_exc()
+            status = 'failed'
+        status_out.write('%s %s %f\n' % (g_render_worker_done_tag, status, time.time() - start_time))
+        status_out.flush()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+BUILD_MESH_CACHE_FOR_ALL_SHAPES
+@brief:
+    optional pre-pass converting every shape to a .blend file in g_mesh_cache_folder, once.
+    all rendering scripts load shapes from the cache when it is there, see scene_utils.import_shape.
+@usage:
+    python run_build_mesh_cache.py                  # all shapes of the 12 categories
+    python run_build_mesh_cache.py a.obj b.ply ...  # only the given models
+    python run_build_mesh_cache.py --verify         # also rebuild cached shapes whose content md5 changed
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.dummy import Pool as ThreadPool
+from subprocess import call
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from shape_catalog import load_one_category_shape_catalog
+from mesh_cache import mesh_cache_filename, check_mesh_cache_file
+
+'''
+@output:
+    True if cache_file has to be (re)built for shape_file
+'''
+def needs_build(shape_and_cache_file, verify=False):
+    shape_file, cache_file = shape_and_cache_file
+    if not os.path.exists(cache_file):
+        return True
+    return verify and not check_mesh_cache_file(shape_file, cache_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert 3D models to .blend files for faster loading')
+    parser.add_argument('shape_files', nargs='*', help='models to convert, all ShapeNet models of the 12 categories if empty')
+    parser.add_argument('--verify', action='store_true', help='compare the stored md5 of cached shapes with their content and rebuild those that differ')
+    args = parser.parse_args()
+
+    if not os.path.exists(g_mesh_cache_folder):
+        os.mkdir(g_mesh_cache_folder)
+
+    if len(args.shape_files) > 0:
+        shape_files = [os.path.abspath(x) for x in args.shape_files]
+    else:
+        shape_files = []
+        for synset in g_shape_synsets:
+            shape_files += [entry.shape_file for entry in load_one_category_shape_catalog(synset)]
+    shape_files = [x for x in shape_files if os.path.exists(x)]
+
+    pool = Pool(g_syn_rendering_thread_num)
+    cache_files = pool.map(mesh_cache_filename, shape_files)
+    build_flags = pool.map(partial(needs_build, verify=args.verify), list(zip(shape_files, cache_files)))
+    pool.close()
+    todo = [(x, y) for x, y, z in zip(shape_files, cache_files, build_flags) if z]
+    print('%d of %d shapes already cached, %d to convert' % (len(shape_files)-len(todo), len(shape_files), len(todo)))
+    if len(todo) == 0:
+        sys.exit(0)
+    # stale cache files found by --verify are removed, so that a failed rebuild is not counted as converted
+    for shape_file, cache_file in todo:
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+    tmp_dirname = tempfile.mkdtemp(dir=g_data_folder, prefix='tmp_mesh_cache_')
+    commands = []
+    for k in range(g_syn_rendering_thread_num):
+        chunk = todo[k::g_syn_rendering_thread_num]
+        if len(chunk) == 0:
+            continue
+        filelist = os.path.join(tmp_dirname, '%d.txt' % (k))
+        with open(filelist, 'w') as fout:
+            for shape_file, cache_file in chunk:
+                fout.write('%s %s\n' % (shape_file, cache_file))
+        commands.append('%s %s --background --python %s -- %s > /dev/null 2>&1' % (g_blender_executable_path, g_blank_blend_file_path, os.path.join(BASE_DIR, 'build_mesh_cache.py'), filelist))
+
+    thread_pool = ThreadPool(len(commands))
+    thread_pool.map(partial(call, shell=True), commands)
+    thread_pool.close()
+    shutil.rmtree(tmp_dirname)
+    cached_num = len([y for x, y in todo if os.path.exists(y)])
+    print('%d shapes converted, %d failed' % (cached_num, len(todo)-cached_num))
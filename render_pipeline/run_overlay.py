@@ -14,14 +14,16 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.dirname(BASE_DIR))
 from global_variables import *
+from overlay_background import build_background_index, overlay_background
 
 if __name__ == '__main__':
     if not os.path.exists(g_syn_images_bkg_overlaid_folder):
         os.mkdir(g_syn_images_bkg_overlaid_folder) 
+    if not os.path.exists(g_syn_bkg_index_file):
+        print('Building background index %s...' % (g_syn_bkg_index_file))
+        build_background_index(g_syn_bkg_filelist, g_syn_bkg_folder, g_syn_bkg_index_file)
     
     for idx in g_overlay_hostname_synset_idx_map[socket.gethostname()]:
         synset = g_shape_synsets[idx]
         print('%d: %s, %s\n' % (idx, synset, g_shape_names[idx]))
-        matlab_cmd = "addpath('%s'); overlay_background('%s','%s','%s', '%s', %f);" % (BASE_DIR, os.path.join(g_syn_images_cropped_folder, synset), os.path.join(g_syn_images_bkg_overlaid_folder, synset), g_syn_bkg_filelist, g_syn_bkg_folder, g_syn_cluttered_bkg_ratio)
-        print matlab_cmd
-        os.system('%s -nodisplay -r "try %s ; catch; end; quit;"' % (g_matlab_executable_path, matlab_cmd))
+        overlay_background(os.path.join(g_syn_images_cropped_folder, synset), os.path.join(g_syn_images_bkg_overlaid_folder, synset), g_syn_bkg_index_file, g_syn_bkg_folder, g_syn_cluttered_bkg_ratio, bkg_cache_folder=g_syn_bkg_cache_folder, bkg_cache_budget=g_syn_bkg_cache_budget)
@@ -4,11 +4,15 @@
 RENDER_ALL_SHAPES
 @brief:
     render all shapes of PASCAL3D 12 rigid object classes
+    rendering is resumable: delete g_syn_images_manifest_folder/<synset>.txt to re-sample views
+@usage:
+    python run_render.py [--refresh_catalog]
 '''
 
 import os
 import sys
 import socket
+import argparse
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
@@ -17,12 +21,25 @@ from global_variables import *
 from render_helper import *
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render all shapes of the categories of this server')
+    parser.add_argument('--refresh_catalog', action='store_true', help='rescan the ShapeNet folders for the shape catalogs, keeping known timings')
+    args = parser.parse_args()
+
     if not os.path.exists(g_syn_images_folder):
         os.mkdir(g_syn_images_folder) 
+    if not os.path.exists(g_syn_images_manifest_folder):
+        os.mkdir(g_syn_images_manifest_folder)
     
     for idx in g_hostname_synset_idx_map[socket.gethostname()]:
         synset = g_shape_synsets[idx]
         print('%d: %s, %s\n' % (idx, synset, g_shape_names[idx]))
-        shape_list = load_one_category_shape_list(synset)
-        view_params = load_one_category_shape_views(synset)
-        render_one_category_model_views(shape_list, view_params)
+        if args.refresh_catalog:
+            load_one_category_shape_catalog(synset, refresh=True)
+        manifest_file = os.path.join(g_syn_images_manifest_folder, synset+'.txt')
+        if not os.path.exists(manifest_file):
+            shape_list = load_one_category_shape_list(synset)
+            view_params = load_one_category_shape_views(synset)
+            create_one_category_render_manifest(shape_list, view_params, manifest_file)
+        else:
+            print('Resuming from render manifest %s' % (manifest_file))
+        render_one_category_model_views(manifest_file)
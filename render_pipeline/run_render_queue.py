@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+RENDER_ALL_SHAPES_WITH_QUEUE
+@brief:
+    render all shapes of PASCAL3D 12 rigid object classes on multiple servers sharing a filesystem.
+    instead of assigning whole categories to servers (g_hostname_synset_idx_map), every shape is
+    a job in a shared queue (g_syn_render_queue_file) and servers pull jobs until none are left.
+@usage:
+    python run_render_queue.py fill [--refresh_catalog]  # once, on one server: write render manifests and enqueue all shapes
+    python run_render_queue.py work     # on every server
+    python run_render_queue.py status
+    python run_render_queue.py catalog  # save the timings of finished jobs to the shape catalogs (done by work too)
+    images already on disk are skipped when filling, so an interrupted queue can be refilled
+    after removing g_syn_render_queue_file.
+'''
+
+import os
+import sys
+import time
+import socket
+import datetime
+import argparse
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_helper import *
+from render_queue import RenderQueue
+
+'''
+@input:
+    refresh_catalog - rescan the ShapeNet folders for the shape catalogs, see load_one_category_shape_catalog
+'''
+def fill_queue(refresh_catalog=False):
+    for folder in [g_syn_images_folder, g_syn_images_manifest_folder, g_syn_render_queue_view_folder]:
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+    queue = RenderQueue(g_syn_render_queue_file)
+    if len(queue.status_counts()) > 0:
+        print('%s already has jobs, remove it first to fill it again' % (g_syn_render_queue_file))
+        queue.close()
+        return
+    jobs = []
+    for idx, synset in enumerate(g_shape_synsets):
+        print('%d: %s, %s\n' % (idx, synset, g_shape_names[idx]))
+        if refresh_catalog:
+            load_one_category_shape_catalog(synset, refresh=True)
+        manifest_file = os.path.join(g_syn_images_manifest_folder, synset+'.txt')
+        if not os.path.exists(manifest_file):
+            shape_list = load_one_category_shape_list(synset)
+            view_params = load_one_category_shape_views(synset)
+            create_one_category_render_manifest(shape_list, view_params, manifest_file)
+        entries = [entry for entry in load_render_manifest(manifest_file) if not is_complete_png(entry.image_file)]
+        if not os.path.exists(os.path.join(g_syn_images_folder, synset)):
+            os.mkdir(os.path.join(g_syn_images_folder, synset))
+        category_jobs = create_render_jobs(entries, g_syn_render_queue_view_folder)
+        jobs += category_jobs
+        print('%d jobs (%d images) to render' % (len(category_jobs), len(entries)))
+    # jobs are handed out in insertion order, most expensive shapes of all categories first
+    queue.add_jobs(sort_render_jobs_by_cost(jobs))
+    print('%d jobs added to %s' % (len(jobs), g_syn_render_queue_file))
+    queue.close()
+
+'''
+@brief:
+    measured seconds per view of all jobs finished so far (by any server) saved to the shape
+    catalogs, so that the next fill orders jobs by their real cost
+'''
+def update_catalogs_from_queue():
+    queue = RenderQueue(g_syn_render_queue_file)
+    jobs, results = queue.finished_jobs()
+    queue.close()
+    update_shape_catalogs(jobs, results)
+    print('Render timings of %d jobs saved to the shape catalogs' % (len(jobs)))
+
+'''
+@brief:
+    g_syn_rendering_thread_num threads, each with its own blender worker and queue connection,
+    pull jobs until the queue is drained. while other jobs are still running (possibly on a
+    crashed server) the threads wait, polling every g_syn_render_queue_poll_interval seconds,
+    so that these jobs are retried once their claim expires. the claim of a job is renewed every
+    g_syn_render_queue_heartbeat_interval seconds while it renders, so only jobs of servers that
+    stopped expire. when the queue is drained, the timings of all finished jobs are saved to
+    the shape catalogs.
+'''
+def work_queue():
+    hostname = socket.gethostname()
+    lock = threading.Lock()
+    counter = [0]
+
+    # renews claim[0] until stop is set, sqlite connections can not be shared between threads
+    def heartbeat(job_id, claim, stop):
+        queue = RenderQueue(g_syn_render_queue_file)
+        while not stop.wait(g_syn_render_queue_heartbeat_interval):
+            claimed_time = queue.renew_claim(job_id, hostname, claim[0])
+            if claimed_time is None:
+                print('Lost the claim of rendering job %d' % (job_id))
+                break
+            claim[0] = claimed_time
+        queue.close()
+
+    def work():
+        queue = RenderQueue(g_syn_render_queue_file)
+        worker = RenderWorker()
+        while True:
+            claimed = queue.claim_job(hostname)
+            if claimed is None:
+                if queue.running_job_count() == 0:
+                    break
+                time.sleep(g_syn_render_queue_poll_interval)
+                continue
+            job_id, job, claimed_time = claimed
+            claim = [claimed_time]
+            stop_heartbeat = threading.Event()
+            heartbeat_thread = threading.Thread(target=heartbeat, args=(job_id, claim, stop_heartbeat))
+            heartbeat_thread.start()
+            try:
+                success, seconds = worker.render(job)
+                success = success and is_render_job_complete(job)
+            finally:
+                stop_heartbeat.set()
+                heartbeat_thread.join()
+            if not queue.finish_job(job_id, hostname, claim[0], success, seconds):
+                print('Rendering job %d (%s) was handed out again, result not recorded' % (job_id, job['shape_file']))
+            elif not success:
+                print('Rendering job %d (%s) failed' % (job_id, job['shape_file']))
+            with lock:
+                counter[0] += 1
+                if counter[0] % 100 == 0:
+                    print('[%s] %s rendered %d jobs' % (datetime.datetime.now().time(), hostname, counter[0]))
+        worker.stop()
+        queue.close()
+
+    threads = [threading.Thread(target=work) for _ in range(g_syn_rendering_thread_num)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('%s: no jobs left, %d jobs rendered' % (hostname, counter[0]))
+    update_catalogs_from_queue()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render all shapes from a job queue shared by multiple servers')
+    parser.add_argument('command', choices=['fill', 'work', 'status', 'catalog'])
+    parser.add_argument('--refresh_catalog', action='store_true', help='fill: rescan the ShapeNet folders for the shape catalogs, keeping known timings')
+    args = parser.parse_args()
+
+    if args.command == 'fill':
+        fill_queue(args.refresh_catalog)
+    elif args.command == 'work':
+        work_queue()
+    elif args.command == 'catalog':
+        update_catalogs_from_queue()
+    else:
+        queue = RenderQueue(g_syn_render_queue_file)
+        print(queue.status_counts())
+        queue.close()
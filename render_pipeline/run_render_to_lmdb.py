@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+RENDER_ALL_SHAPES_TO_LMDB
+@brief:
+    streaming alternative to run_render.py + run_crop.py + run_overlay.py + view_estimation/prepare_training_data.py:
+    images are cropped in blender right after rendering, spooled to memory (g_syn_stream_spool_folder),
+    overlaid with backgrounds, resized to g_images_resize_dim and written straight to the training
+    image and label LMDBs (g_syn_images_lmdb_pathname_prefix+'_[train,test]_[image,label]').
+    the cropped and overlaid image folders are only written for debugging (--keep_cropped/--keep_overlaid).
+    each image gets a random LMDB key, so the LMDBs are shuffled like the ones of prepare_training_data.py.
+    keys of images that failed are left out and the others renumbered when the LMDBs are closed,
+    so keys are always 0..N-1.
+@usage:
+    python run_render_to_lmdb.py [--ignore_angle] [--keep_cropped] [--keep_overlaid] [--refresh_catalog]
+'''
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import argparse
+import datetime
+import time
+import multiprocessing
+import numpy as np
+import lmdb
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(BASE_DIR))
+sys.path.append(os.path.join(os.path.dirname(BASE_DIR), 'view_estimation'))
+from global_variables import *
+from render_helper import *
+from overlay_background import build_background_index, load_background_index, init_overlay_worker, overlay_random_background
+from data_prep_helper import path2label, view2label
+from caffe_utils import imarray2datum, vector2datum, set_datum_label
+
+'''
+@input:
+    (split, key, spool_image_file, label, cropped_image_file, overlaid_image_file), the debug
+    image files are None when they are not kept
+@output:
+    (split, key, serialized image datum, serialized label datum, error message or None)
+'''
+def overlay_to_datum(item):
+    split, key, spool_image_file, label, cropped_image_file, overlaid_image_file = item
+    try:
+        im = Image.open(spool_image_file)
+        if im.mode != 'RGBA':
+            im = im.convert('RGBA')
+        rgba = np.asarray(im)
+    except (IOError, OSError):
+        return (split, key, None, None, 'Failed to render %s' % (os.path.basename(spool_image_file)))
+    if cropped_image_file is not None:
+        shutil.move(spool_image_file, cropped_image_file)
+    else:
+        os.remove(spool_image_file)
+
+    im = Image.fromarray(overlay_random_background(rgba))
+    if overlaid_image_file is not None:
+        im.save(overlaid_image_file)
+    im = np.array(im.resize((g_images_resize_dim, g_images_resize_dim), Image.ANTIALIAS))
+    return (split, key, imarray2datum(im, key), vector2datum(label, key), None)
+
+'''
+@brief:
+    image and label LMDBs of one split, committed every commit_step images
+'''
+class LMDBPairWriter(object):
+    def __init__(self, output_lmdb, commit_step=1000):
+        self.dbs = [lmdb.open(output_lmdb+'_image', map_size=int(1e12)), lmdb.open(output_lmdb+'_label', map_size=int(1e12))]
+        self.txns = [db.begin(write=True) for db in self.dbs]
+        self.commit_step = commit_step
+        self.num = 0
+        self.keys = []
+
+    def put(self, key, image_datum, label_datum):
+        keyname = '%010d' % key
+        self.txns[0].put(keyname, image_datum)
+        self.txns[1].put(keyname, label_datum)
+        self.keys.append(key)
+        self.num += 1
+        if self.num % self.commit_step == 0:
+            self.commit()
+            self.txns = [db.begin(write=True) for db in self.dbs]
+
+    def commit(self):
+        for txn in self.txns:
+            txn.commit()
+
+    '''
+    @brief:
+        renumber the written keys to 0..num-1 (in key order, labels of the datums too), keys of
+        images that were not written leave holes otherwise. entries only move to smaller keys,
+        which are free or already moved, so this is done in place.
+    '''
+    def compact(self):
+        keys = sorted(self.keys)
+        if len(keys) == 0 or keys[-1] == len(keys) - 1:
+            return
+        print('Renumbering %d keys of %s' % (len(keys), self.dbs[0].path()))
+        for db in self.dbs:
+            txn = db.begin(write=True)
+            for new_key, key in enumerate(keys):
+                if new_key == key:
+                    continue
+                keyname = '%010d' % key
+                txn.put('%010d' % new_key, set_datum_label(txn.get(keyname), new_key))
+                txn.delete(keyname)
+                if (new_key + 1) % self.commit_step == 0:
+                    txn.commit()
+                    txn = db.begin(write=True)
+            txn.commit()
+
+    def close(self):
+        self.commit()
+        self.compact()
+        for db in self.dbs:
+            db.close()
+
+'''
+@input:
+    shape_list - list of (synset, md5, shape_file, view_num) of all categories
+    split_md5s - dict from split name to the set of md5s of that split
+@output:
+    (render jobs, images of each job as input items of overlay_to_datum)
+'''
+def create_stream_jobs(shape_list, split_md5s, spool_folder, args):
+    entries = []
+    for synset in sorted(set([x[0] for x in shape_list])):
+        synset_shape_list = [x for x in shape_list if x[0] == synset]
+        manifest_file = os.path.join(spool_folder, synset+'.txt')
+        entries += create_one_category_render_manifest(synset_shape_list, load_one_category_shape_views(synset), manifest_file)
+    # images are spooled, the manifest image files are kept for naming only. views of a shape can
+    # round to the same name, the view index is added to make the spool files unique
+    entries = [entry._replace(image_file=os.path.join(spool_folder, entry.synset, entry.md5, '%s_v%07d%s' % (os.path.splitext(os.path.basename(entry.image_file))[0], view_idx, os.path.splitext(entry.image_file)[1]))) \
+               for view_idx, entry in enumerate(entries)]
+    jobs = sort_render_jobs_by_cost(create_render_jobs(entries, spool_folder, crop=True))
+    for job in jobs:
+        job['png_compression'] = 0 # spooled images are read back right away
+
+    # random keys shuffle the LMDBs
+    split_keys = {}
+    for split, md5s in split_md5s.items():
+        split_keys[split] = list(np.random.permutation(len([entry for entry in entries if entry.md5 in md5s])))
+    job_items = []
+    for job in jobs:
+        split = [x for x, md5s in split_md5s.items() if job['shape_md5'] in md5s][0]
+        class_idx = g_shape_synsets.index(job['shape_synset'])
+        items = []
+        for line in open(job['view_file'], 'r'):
+            image_file = line.rstrip().split(' ')[4]
+            azimuth, elevation, tilt = path2label(image_file)
+            if args.ignore_angle:
+                label = [class_idx]
+            else:
+                label = [class_idx, view2label(azimuth, class_idx), view2label(elevation, class_idx), view2label(tilt, class_idx)]
+            relative_image_file = os.path.join(job['shape_synset'], job['shape_md5'], os.path.basename(image_file))
+            cropped_image_file = os.path.join(g_syn_images_cropped_folder, relative_image_file) if args.keep_cropped else None
+            overlaid_image_file = os.path.splitext(os.path.join(g_syn_images_bkg_overlaid_folder, relative_image_file))[0] + '.jpg' if args.keep_overlaid else None
+            for debug_image_file in [cropped_image_file, overlaid_image_file]:
+                if debug_image_file is not None and not os.path.exists(os.path.dirname(debug_image_file)):
+                    os.makedirs(os.path.dirname(debug_image_file))
+            items.append((split, split_keys[split].pop(), image_file, label, cropped_image_file, overlaid_image_file))
+        job_items.append(items)
+    return jobs, job_items
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render, crop, overlay and write images straight to the training LMDBs')
+    parser.add_argument('--ignore_angle', action='store_true', help='labels are only class indices (as prepare_training_data.py)')
+    parser.add_argument('--keep_cropped', action='store_true', help='also save cropped images to g_syn_images_cropped_folder')
+    parser.add_argument('--keep_overlaid', action='store_true', help='also save overlaid images to g_syn_images_bkg_overlaid_folder')
+    parser.add_argument('--train_ratio', type=float, default=0.9, help='ratio of shapes whose images go to the train LMDBs')
+    parser.add_argument('--refresh_catalog', action='store_true', help='rescan the ShapeNet folders for the shape catalogs, keeping known timings')
+    args = parser.parse_args()
+
+    output_lmdbs = dict([(split, '%s_%s' % (g_syn_images_lmdb_pathname_prefix, split)) for split in ['train', 'test']])
+    for output_lmdb in output_lmdbs.values():
+        if os.path.exists(output_lmdb+'_image') or os.path.exists(output_lmdb+'_label'):
+            print('%s_[image,label] already exists, remove it first' % (output_lmdb))
+            sys.exit(1)
+    if not os.path.exists(g_syn_bkg_index_file):
+        print('Building background index %s...' % (g_syn_bkg_index_file))
+        build_background_index(g_syn_bkg_filelist, g_syn_bkg_folder, g_syn_bkg_index_file)
+
+    # split shapes to train/test as get_one_category_image_label_file
+    shape_list = []
+    split_md5s = {'train': set(), 'test': set()}
+    for idx in g_hostname_synset_idx_map[socket.gethostname()]:
+        synset = g_shape_synsets[idx]
+        if args.refresh_catalog:
+            load_one_category_shape_catalog(synset, refresh=True)
+        synset_shape_list = load_one_category_shape_list(synset)
+        train_test_split = int(len(synset_shape_list)*args.train_ratio)
+        split_md5s['train'].update([x[1] for x in synset_shape_list[0:train_test_split]])
+        split_md5s['test'].update([x[1] for x in synset_shape_list[train_test_split:]])
+        shape_list += synset_shape_list
+
+    spool_folder = tempfile.mkdtemp(dir=g_syn_stream_spool_folder, prefix='render4cnn_spool_')
+    print('Generating rendering jobs...')
+    jobs, job_items = create_stream_jobs(shape_list, split_md5s, spool_folder, args)
+    print('done (%d jobs, %d images)!' % (len(jobs), sum([len(x) for x in job_items])))
+
+    # images of a job are handed to the overlay workers as soon as blender is done with the job
+    render_results = [None] * len(jobs)
+    def iter_rendered_items():
+        for job_idx, success, seconds in imap_render_jobs_with_workers(jobs):
+            render_results[job_idx] = (success, seconds)
+            if not success:
+                print('Rendering job %d of %d (%s) failed' % (job_idx, len(jobs), jobs[job_idx]['shape_file']))
+            for item in job_items[job_idx]:
+                yield item
+
+    print('Rendering to LMDB at time %s, it takes long time...' % (datetime.datetime.now().time()))
+    t_begin = time.time()
+    writers = dict([(split, LMDBPairWriter(output_lmdb)) for split, output_lmdb in output_lmdbs.items()])
+    initargs = (load_background_index(g_syn_bkg_index_file), g_syn_bkg_folder, g_syn_cluttered_bkg_ratio, g_syn_bkg_cache_folder, g_syn_bkg_cache_budget)
+    pool = multiprocessing.Pool(multiprocessing.cpu_count(), initializer=init_overlay_worker, initargs=initargs)
+    report_step = 10000
+    image_num = 0
+    failed_num = 0
+    for split, key, image_datum, label_datum, error in pool.imap_unordered(overlay_to_datum, iter_rendered_items(), chunksize=16):
+        image_num += 1
+        if error is not None:
+            failed_num += 1
+            print(error)
+        else:
+            writers[split].put(key, image_datum, label_datum)
+        if image_num % report_step == 0:
+            print('[%s] %d images written' % (datetime.datetime.now().time(), image_num))
+    pool.close()
+    pool.join()
+    for writer in writers.values():
+        writer.close()
+    update_shape_catalogs(jobs, render_results)
+    shutil.rmtree(spool_folder)
+    print('%d images in total, %d failed.' % (image_num, failed_num))
+    print('%f seconds spent on rendering to LMDB!' % (time.time() - t_begin))
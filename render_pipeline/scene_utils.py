@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+SCENE_UTILS.py
+brief:
+	Helper functions to manage the blender scene (importing, clearing shapes, lights,
+	reading back rendered pixels) shared by the rendering scripts. Only usable inside blender.
+'''
+import os
+import sys
+import bpy
+import math
+import random
+import numpy as np
+from mathutils import Vector
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from render_pipeline.blender_utils import *
+from render_pipeline.mesh_cache import *
+from render_pipeline.crop_utils import *
+from render_pipeline.bbox_sidecar import *
+
+'''
+@input:
+    shape_file - .obj/.ply/.dae file of the 3D shape model
+@output:
+    shape is imported into the current scene as it is, with blender's importers
+'''
+def import_shape_file(shape_file):
+    if shape_file[-3:] == 'obj':
+        bpy.ops.import_scene.obj(filepath=shape_file)
+    elif shape_file[-3:] == 'ply':
+        bpy.ops.import_mesh.ply(filepath=shape_file)
+    elif shape_file[-3:] == 'dae':
+        bpy.ops.wm.collada_import(filepath=shape_file)
+
+'''
+@brief:
+    append the mesh objects saved in a mesh cache file to the current scene,
+    appended objects are selected like after an import
+'''
+def append_cached_shape(cache_file):
+    with bpy.data.libraries.load(cache_file) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    scene = bpy.context.scene
+    for obj in scene.objects:
+        obj.select = False
+    for obj in data_to.objects:
+        if obj is None:
+            continue
+        scene.objects.link(obj)
+        obj.select = True
+        scene.objects.active = obj
+
+'''
+@input:
+    shape_file - .obj/.ply/.dae file of the 3D shape model
+    scale - resize factor applied to imported .ply meshes
+@output:
+    shape is imported into the current scene, from g_mesh_cache_folder if it has been cached
+'''
+def import_shape(shape_file, scale=0.001):
+    cache_file = get_mesh_cache_file(shape_file)
+    if cache_file is not None:
+        append_cached_shape(cache_file)
+    else:
+        import_shape_file(shape_file)
+    if shape_file[-3:] == 'ply':
+        bpy.ops.transform.resize(value=(scale, scale, scale))
+
+'''
+@brief:
+    remove all mesh objects from the scene together with the datablocks they leave
+    behind, so that a long-lived blender process can render shape after shape without
+    accumulating data. Camera, lamps and world settings are kept.
+'''
+def clear_shapes():
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        if obj.type == 'MESH':
+            scene.objects.unlink(obj)
+            bpy.data.objects.remove(obj)
+    for datablocks in (bpy.data.meshes, bpy.data.lamps, bpy.data.materials, bpy.data.textures):
+        for block in list(datablocks):
+            if block.users == 0:
+                datablocks.remove(block)
+    for image in list(bpy.data.images):
+        if image.type == 'IMAGE' and image.users == 0:
+            bpy.data.images.remove(image)
+
+'''
+@brief:
+    level-of-detail versions of the shape in the scene: decimated copies of its meshes
+    (g_syn_lod_ratios of the faces) are built once, then for each view the objects are switched
+    to the coarsest level whose minimum projected size (g_syn_lod_min_sizes, diameter of the
+    bounding sphere in pixels) is reached.
+'''
+class LODShape(object):
+    def __init__(self, ratios=g_syn_lod_ratios, min_sizes=g_syn_lod_min_sizes):
+        scene = bpy.context.scene
+        self.ratios = ratios
+        self.min_sizes = min_sizes
+        self.objs = [obj for obj in scene.objects if obj.type == 'MESH']
+        self.meshes = []
+        for obj in self.objs:
+            levels = [obj.data]
+            for ratio in ratios[1:]:
+                modifier = obj.modifiers.new('lod', 'DECIMATE')
+                modifier.ratio = ratio
+                levels.append(obj.to_mesh(scene, True, 'RENDER'))
+                obj.modifiers.remove(modifier)
+            self.meshes.append(levels)
+        corners = [obj.matrix_world * Vector(corner) for obj in self.objs for corner in obj.bound_box]
+        self.center = sum(corners, Vector((0, 0, 0))) / max(len(corners), 1)
+        self.radius = max([(corner - self.center).length for corner in corners] + [0])
+
+    '''
+    @output:
+        diameter in pixels of the bounding sphere of the shape seen from cam
+    '''
+    def projected_size(self, cam):
+        render = bpy.context.scene.render
+        image_size = max(render.resolution_x, render.resolution_y) * render.resolution_percentage / 100
+        focal_length = image_size / (2 * math.tan(cam.data.angle / 2))
+        distance = (cam.location - self.center).length - self.radius
+        return 2 * self.radius * focal_length / max(distance, 1e-6)
+
+    '''
+    @brief:
+        switch the shape to the level of detail for the current pose of cam
+    @output:
+        (level, number of faces rendered)
+    '''
+    def select(self, cam):
+        size = self.projected_size(cam)
+        level = len(self.ratios) - 1
+        for k, min_size in enumerate(self.min_sizes):
+            if size >= min_size:
+                level = k
+                break
+        for obj, levels in zip(self.objs, self.meshes):
+            obj.data = levels[level]
+        return (level, sum([len(levels[level].polygons) for levels in self.meshes]))
+
+'''
+@brief:
+    a fixed pool of point lamps created once through bpy.data. For each view the lamps are
+    moved, re-energized or hidden, instead of deleting and adding lamps with operators which
+    triggers scene updates and gets slower as datablocks pile up.
+'''
+class LightRig(object):
+    def __init__(self, lamp_num=g_syn_light_num_highbound):
+        scene = bpy.context.scene
+        self.lamps = []
+        for i in range(lamp_num):
+            lamp_data = bpy.data.lamps.new(name='RigPoint%d' % (i), type='POINT')
+            lamp = bpy.data.objects.new(name='RigPoint%d' % (i), object_data=lamp_data)
+            scene.objects.link(lamp)
+            self.lamps.append(lamp)
+        # energy of a newly added point lamp
+        self.default_energy = self.lamps[0].data.energy if lamp_num > 0 else 1.0
+
+    '''
+    @input:
+        lights - list of ((x, y, z), energy), at most as many as lamps in the rig
+    '''
+    def set_lights(self, lights):
+        for i, lamp in enumerate(self.lamps):
+            if i < len(lights):
+                lamp.location = lights[i][0]
+                lamp.data.energy = lights[i][1]
+                lamp.hide_render = False
+            else:
+                lamp.hide_render = True
+
+'''
+@brief:
+    random environment light and point lights (g_syn_light_* distributions) for one view
+'''
+def set_random_lighting(light_rig):
+    # set environment lighting
+    #bpy.context.space_data.context = 'WORLD'
+    bpy.context.scene.world.light_settings.use_environment_light = True
+    bpy.context.scene.world.light_settings.environment_energy = np.random.uniform(g_syn_light_environment_energy_lowbound, g_syn_light_environment_energy_highbound)
+    bpy.context.scene.world.light_settings.environment_color = 'PLAIN'
+    # set point lights
+    # energies as with the lamps added by bpy.ops.object.lamp_add before: every sampled energy was
+    # assigned to the object named 'Point' (the first lamp), so the first lamp gets the last sample
+    # and the other lamps keep the default energy of a new lamp
+    lights = []
+    for i in range(random.randint(g_syn_light_num_lowbound, g_syn_light_num_highbound)):
+        light_azimuth_deg = np.random.uniform(g_syn_light_azimuth_degree_lowbound, g_syn_light_azimuth_degree_highbound)
+        light_elevation_deg  = np.random.uniform(g_syn_light_elevation_degree_lowbound, g_syn_light_elevation_degree_highbound)
+        light_dist = np.random.uniform(g_syn_light_dist_lowbound, g_syn_light_dist_highbound)
+        lx, ly, lz = obj_centened_camera_pos(light_dist, light_azimuth_deg, light_elevation_deg)
+        energy = np.random.normal(g_syn_light_energy_mean, g_syn_light_energy_std)
+        lights.append(((lx, ly, lz), light_rig.default_energy))
+        lights[0] = (lights[0][0], energy)
+    light_rig.set_lights(lights)
+
+'''
+@brief:
+    route the render result through the compositor to a viewer node, so that rendered
+    pixels can be read back with get_viewer_rgba (the render result itself has no pixels
+    in background mode). Can be called repeatedly.
+'''
+def enable_viewer_node():
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    tree = scene.node_tree
+    if 'Viewer' in tree.nodes:
+        return
+    for node in list(tree.nodes):
+        tree.nodes.remove(node)
+    render_layers = tree.nodes.new('CompositorNodeRLayers')
+    composite = tree.nodes.new('CompositorNodeComposite')
+    viewer = tree.nodes.new('CompositorNodeViewer')
+    viewer.name = 'Viewer'
+    viewer.use_alpha = True
+    tree.links.new(render_layers.outputs['Image'], composite.inputs['Image'])
+    tree.links.new(render_layers.outputs['Alpha'], composite.inputs['Alpha'])
+    tree.links.new(render_layers.outputs['Image'], viewer.inputs['Image'])
+    tree.links.new(render_layers.outputs['Alpha'], viewer.inputs['Alpha'])
+
+'''
+@brief:
+    enable the z pass and show it in the viewer node instead of the image,
+    the composite output (i.e. the saved image) is unchanged
+'''
+def enable_depth_viewer_node():
+    enable_viewer_node()
+    scene = bpy.context.scene
+    for layer in scene.render.layers:
+        layer.use_pass_z = True
+    tree = scene.node_tree
+    render_layers = [node for node in tree.nodes if node.type == 'R_LAYERS'][0]
+    viewer = tree.nodes['Viewer']
+    viewer.use_alpha = False
+    tree.links.new(render_layers.outputs['Z'], viewer.inputs['Image'])
+
+'''
+@output:
+    HxW float32 depth (distance along the camera axis, 1e10 for the background) of the last render,
+    first row is the top of the image. enable_depth_viewer_node must be called before rendering.
+'''
+def get_viewer_depth():
+    return np.ascontiguousarray(get_viewer_rgba()[:,:,0])
+
+'''
+@output:
+    HxWx4 float32 array of the last render (premultiplied linear RGBA), first row is the top of the image
+'''
+def get_viewer_rgba():
+    image = bpy.data.images['Viewer Node']
+    width, height = image.size
+    return np.array(image.pixels[:], dtype=np.float32).reshape(height, width, 4)[::-1]
+
+'''
+@brief:
+    save an array as returned by get_viewer_rgba to filepath with the scene's output
+    settings and color management, i.e. the same way write_still saves a render
+'''
+def save_rgba(rgba, filepath):
+    height, width = rgba.shape[0:2]
+    image = bpy.data.images.new('crop', width=width, height=height, alpha=True, float_buffer=True)
+    image.pixels[:] = rgba[::-1].ravel()
+    image.save_render(filepath, bpy.context.scene)
+    bpy.data.images.remove(image)
+
+'''
+@brief:
+    alpha channel of the last render as stored in an 8-bit png, see get_viewer_rgba
+'''
+def get_viewer_alpha(rgba):
+    return np.round(np.clip(rgba[:,:,3], 0, 1) * 255).astype(np.uint8)
+
+'''
+@brief:
+    render the current view to filepath, without the compositor and pixel readback of render_with_bbox
+'''
+def render_still(filepath):
+    scene = bpy.context.scene
+    scene.use_nodes = False
+    scene.render.filepath = filepath
+    bpy.ops.render.render(write_still=True)
+
+'''
+@input:
+    filepath - output image file
+@output:
+    render the current view to filepath (as write_still) and return the tight box of the object,
+    (top, bottom, left, right) as crop_utils.get_alpha_bbox, None if nothing is visible
+'''
+def render_with_bbox(filepath):
+    enable_viewer_node()
+    bpy.context.scene.render.filepath = filepath
+    bpy.ops.render.render(write_still=True)
+    return get_alpha_bbox(get_viewer_alpha(get_viewer_rgba()))
+
+'''
+@input:
+    filepath - output image file
+    truncation_param - one line of a truncation distribution file, see crop_utils.get_truncated_crop_box
+@output:
+    render the current view and save only the object crop, like render + crop_images.m would.
+    returns (bbox, crop_box): tight box of the object in the saved crop (None if the crop misses it) and
+    crop box in the full frame, both (top, bottom, left, right), or None if nothing is visible (no image
+    is written in that case)
+'''
+def render_cropped(filepath, truncation_param):
+    enable_viewer_node()
+    bpy.ops.render.render()
+    rgba = get_viewer_rgba()
+    # compare alpha the way it is stored in an 8-bit png
+    alpha = get_viewer_alpha(rgba)
+    full_bbox = get_alpha_bbox(alpha)
+    if full_bbox is None:
+        return None
+    crop_box = get_truncated_crop_box(full_bbox, truncation_param, alpha.shape[0:2])
+    top, bottom, left, right = crop_box
+    save_rgba(rgba[top:bottom+1, left:right+1], filepath)
+    # the crop may truncate the object
+    bbox = (max(full_bbox[0], top) - top, min(full_bbox[1], bottom) - top, max(full_bbox[2], left) - left, min(full_bbox[3], right) - left)
+    if bbox[0] > bbox[1] or bbox[2] > bbox[3]: # the crop misses the object
+        bbox = None
+    return (bbox, crop_box)
+
+'''
+@output:
+    line of a bbox sidecar (see bbox_sidecar.py) from boxes as returned by render_with_bbox/render_cropped
+'''
+def bbox_sidecar_line(bbox, crop_box=None):
+    line = [bbox[2], bbox[0], bbox[3], bbox[1]]
+    if crop_box is not None:
+        line += [crop_box[2], crop_box[0], crop_box[3], crop_box[1]]
+    return line
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''
+SHAPE_CATALOG.py
+brief:
+	cached per-category catalog of shapes with their size and measured rendering cost.
+	the catalog of a synset is saved to g_shape_catalog_folder/<synset>.txt, each line is
+	'<md5> <obj_filename> <vertex_num> <face_num> <file_size> <seconds_per_view>'
+	seconds_per_view is -1 until the shape has been rendered once.
+'''
+
+import os
+import sys
+import socket
+from collections import namedtuple
+import multiprocessing
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+
+ShapeCatalogEntry = namedtuple('ShapeCatalogEntry', ['md5', 'shape_file', 'vertex_num', 'face_num', 'file_size', 'seconds_per_view'])
+
+'''
+@output:
+    (vertex_num, face_num) of an .obj file, (0, 0) if it can not be read
+'''
+def count_obj_elements(obj_file):
+    vertex_num = 0
+    face_num = 0
+    try:
+        with open(obj_file, 'rb') as f:
+            for line in f:
+                if line.startswith(b'v '):
+                    vertex_num += 1
+                elif line.startswith(b'f '):
+                    face_num += 1
+    except (IOError, OSError):
+        pass
+    return (vertex_num, face_num)
+
+def shape_catalog_entry(md5_shape_file):
+    md5, shape_file = md5_shape_file
+    vertex_num, face_num = count_obj_elements(shape_file)
+    file_size = os.path.getsize(shape_file) if os.path.exists(shape_file) else 0
+    return ShapeCatalogEntry(md5, shape_file, vertex_num, face_num, file_size, -1.0)
+
+def write_shape_catalog(catalog_file, catalog):
+    # servers sharing the catalog folder may write at the same time, the last rename wins
+    tmp_catalog_file = '%s.tmp.%s.%d' % (catalog_file, socket.gethostname(), os.getpid())
+    with open(tmp_catalog_file, 'w') as fout:
+        for entry in catalog:
+            fout.write('%s %s %d %d %d %f\n' % tuple(entry))
+    os.rename(tmp_catalog_file, catalog_file)
+
+'''
+@input:
+    shape_synset e.g. '03001627'
+    refresh - rescan the ShapeNet synset folder, keeping render timings of known shapes
+@output:
+    list of ShapeCatalogEntry of the synset, built (with g_syn_rendering_thread_num processes)
+    and saved on first use
+'''
+def load_one_category_shape_catalog(shape_synset, refresh=False):
+    catalog_file = os.path.join(g_shape_catalog_folder, shape_synset+'.txt')
+    catalog = []
+    if os.path.exists(catalog_file):
+        for line in open(catalog_file, 'r'):
+            ll = line.rstrip().split(' ')
+            catalog.append(ShapeCatalogEntry(ll[0], ll[1], int(ll[2]), int(ll[3]), int(ll[4]), float(ll[5])))
+        if not refresh:
+            return catalog
+
+    print('Building shape catalog of %s...' % (shape_synset))
+    known = dict([(entry.md5, entry) for entry in catalog])
+    shape_md5_list = sorted(os.listdir(os.path.join(g_shapenet_root_folder, shape_synset)))
+    shape_files = [(md5, os.path.join(g_shapenet_root_folder, shape_synset, md5, 'model.obj')) for md5 in shape_md5_list]
+    pool = multiprocessing.Pool(g_syn_rendering_thread_num)
+    catalog = pool.map(shape_catalog_entry, [x for x in shape_files if x[0] not in known])
+    pool.close()
+    catalog = sorted(catalog + [known[md5] for md5, _ in shape_files if md5 in known], key=lambda entry: entry.md5)
+
+    if not os.path.exists(g_shape_catalog_folder):
+        os.mkdir(g_shape_catalog_folder)
+    write_shape_catalog(catalog_file, catalog)
+    return catalog
+
+'''
+@input:
+    shape_seconds_per_view - dict of md5 -> measured render seconds per view
+@output:
+    seconds_per_view of these shapes updated in the saved catalog
+'''
+def update_one_category_shape_catalog(shape_synset, shape_seconds_per_view):
+    catalog = load_one_category_shape_catalog(shape_synset)
+    catalog = [entry._replace(seconds_per_view=shape_seconds_per_view[entry.md5]) if entry.md5 in shape_seconds_per_view else entry for entry in catalog]
+    write_shape_catalog(os.path.join(g_shape_catalog_folder, shape_synset+'.txt'), catalog)
+
+'''
+@output:
+    (slope, intercept) of render seconds per view as a linear function of the face number,
+    fitted over the timed entries, None if there are not enough of them
+'''
+def fit_seconds_per_view(entries):
+    timed = [entry for entry in entries if entry.seconds_per_view > 0]
+    if len(timed) < 2 or len(set([entry.face_num for entry in timed])) < 2:
+        return None
+    slope, intercept = np.polyfit([entry.face_num for entry in timed], [entry.seconds_per_view for entry in timed], 1)
+    return (max(slope, 0), max(intercept, 0))
+
+'''
+@input:
+    fallback_fit - (slope, intercept) used if the catalog has too few timed shapes, e.g. the fit
+                   over all categories. without it g_syn_render_seconds_per_face and
+                   g_syn_render_seconds_per_view_base are used
+@output:
+    dict of md5 -> estimated render seconds per view. Shapes not rendered yet are estimated from
+    their face number with a linear fit over the shapes that have been timed, so estimates of
+    different catalogs can be compared.
+'''
+def estimate_seconds_per_view(catalog, fallback_fit=None):
+    fit = fit_seconds_per_view(catalog) or fallback_fit or (g_syn_render_seconds_per_face, g_syn_render_seconds_per_view_base)
+    slope, intercept = fit
+    return dict([(entry.md5, entry.seconds_per_view if entry.seconds_per_view > 0 else intercept + slope*entry.face_num) for entry in catalog])
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+'''
+Benchmark of image decoding for the image LMDBs
+
+Decodes and resizes images the way imglabel2datum does, with and without JPEG draft mode
+(see load_resized_image in caffe_utils.py), and reports images/sec of both paths and the pixel
+differences between them. Exits with status 1 if the mean absolute difference of an image is
+above --tolerance.
+
+Usage:
+    python benchmark_image_decoding.py <image_label_file or image folder> [-n 1000] [--tolerance 2]
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(BASE_DIR))
+from global_variables import *
+from caffe_utils import load_resized_image, imarray2datum
+
+parser = argparse.ArgumentParser(description='Benchmark JPEG draft decoding against full decoding.')
+parser.add_argument('images', help='txt file each line of which starts with an image filename, or a folder of images')
+parser.add_argument('-n', '--num', help='Number of images to test.', default=1000, type=int)
+parser.add_argument('--resize_dim', default=g_images_resize_dim, type=int)
+parser.add_argument('--tolerance', help='Maximum mean absolute pixel difference of an image.', default=2.0, type=float)
+args = parser.parse_args()
+
+if os.path.isdir(args.images):
+    img_filenames = [os.path.join(args.images, x) for x in sorted(os.listdir(args.images)) if x.lower().endswith(('.jpg', '.jpeg', '.png'))]
+else:
+    img_filenames = [line.rstrip().split(' ')[0] for line in open(args.images, 'r')]
+img_filenames = img_filenames[0:args.num]
+if len(img_filenames) == 0:
+    print('no images found in %s' % (args.images))
+    sys.exit(1)
+print('%d images' % (len(img_filenames)))
+
+def run(draft):
+    start_time = time.time()
+    ims = []
+    for imname in img_filenames:
+        im = load_resized_image(imname, args.resize_dim, draft)
+        imarray2datum(im, 0)
+        ims.append(im)
+    seconds = time.time() - start_time
+    print('draft=%s: %.1f images/sec' % (draft, len(img_filenames) / max(seconds, 1e-6)))
+    return ims
+
+full_ims = run(False)
+draft_ims = run(True)
+
+diffs = np.array([np.mean(np.abs(a.astype(np.int16) - b.astype(np.int16))) for a, b in zip(full_ims, draft_ims)])
+max_diffs = np.array([np.max(np.abs(a.astype(np.int16) - b.astype(np.int16))) for a, b in zip(full_ims, draft_ims)])
+print('mean abs pixel difference: mean %.3f, max %.3f (%s)' % (np.mean(diffs), np.max(diffs), img_filenames[int(np.argmax(diffs))]))
+print('max abs pixel difference: %d' % (np.max(max_diffs)))
+failed_num = int(np.sum(diffs > args.tolerance))
+if failed_num > 0:
+    print('%d images above tolerance %.2f' % (failed_num, args.tolerance))
+    sys.exit(1)
+print('all images within tolerance %.2f' % (args.tolerance))
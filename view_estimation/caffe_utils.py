@@ -5,7 +5,9 @@ import math
 import numpy as np
 import argparse
 from PIL import Image
-from multiprocessing import Pool
+import bisect
+import hashlib
+from multiprocessing import Pool, Process
 import datetime
 from google.protobuf import text_format
 import scipy.ndimage
@@ -19,61 +21,245 @@ sys.path.append(g_caffe_python_folder)
 import caffe
 from caffe.proto import caffe_pb2
 
+# CxHxW uint8 buffers reused by imarray2datum, one per image size
+chw_buffers = {}
+
 '''
 @brief:
-    get serialized datum of image-label pair, used solely for caffe
+    get serialized datum of an image array, used solely for caffe
 @input:
-    img_label - (img_filename, label)
+    im - HxWx3 (RGB) or HxW (gray) uint8 array, already resized
+    label - datum label
+    label_vector - values stored in float_data of the datum, next to the image (optional)
 @output:
-    serialized datum of resized,colored,channel-swapped,transposed image
+    serialized datum of colored,channel-swapped,transposed image
+    (channels are swapped and transposed by copying into a preallocated CxHxW buffer)
 '''
-def imglabel2datum(img_label):
-    imname, label = img_label
+def imarray2datum(im, label, label_vector=None):
+    H, W = np.shape(im)[0:2]
+    if (H, W) not in chw_buffers:
+        chw_buffers[(H, W)] = np.empty((3, H, W), dtype=np.uint8)
+    chw = chw_buffers[(H, W)]
+    if len(np.shape(im)) == 2: # gray image, convert to color
+        chw[:] = im
+    else:
+        # change RGB to BGR and H*W*C to C*H*W
+        for c in range(3):
+            chw[c] = im[:,:,2-c]
+    datum = caffe.io.array_to_datum(chw, label)
+    if label_vector is not None:
+        datum.float_data.extend([float(x) for x in label_vector])
+    datum = datum.SerializeToString()
+    return datum
+
+'''
+@brief:
+    serialized datum with its label replaced
+'''
+def set_datum_label(serialized_datum, label):
+    datum = caffe_pb2.Datum()
+    datum.ParseFromString(serialized_datum)
+    datum.label = label
+    return datum.SerializeToString()
+
+'''
+@brief:
+    decode a datum written by imarray2datum
+@output:
+    (CxHxW uint8 BGR image, float32 array of the label vector, empty if the datum has none)
+'''
+def datum2imglabel(serialized_datum):
+    datum = caffe_pb2.Datum()
+    datum.ParseFromString(serialized_datum)
+    im = np.frombuffer(datum.data, dtype=np.uint8).reshape((datum.channels, datum.height, datum.width))
+    return (im, np.array(datum.float_data, dtype=np.float32))
+
+'''
+@brief:
+    load an image resized to resize_dim x resize_dim
+@input:
+    draft - JPEG images are decoded at the smallest 1/2, 1/4 or 1/8 scale that is still at least
+            resize_dim (PIL draft mode) before the resize, instead of at full size
+@output:
+    HxWx3 (RGB) or HxW (gray) uint8 array
+'''
+def load_resized_image(imname, resize_dim=g_images_resize_dim, draft=g_images_jpeg_draft):
     im = Image.open(imname)
+    if draft and im.format == 'JPEG':
+        im.draft(im.mode, (resize_dim, resize_dim))
     #  ** resize **
-    im = im.resize((g_images_resize_dim, g_images_resize_dim), Image.ANTIALIAS)
+    im = im.resize((resize_dim, resize_dim), Image.ANTIALIAS)
     # convert to array
-    im = np.array(im)
-    # convert gray to color
-    if len(np.shape(im)) == 2: # gray image
-        im = im[:,:,np.newaxis]
-        im = np.tile(im, [1,1,3])
-    # change RGB to BGR
-    im = im[:,:,::-1]
-    # change H*W*C to C*H*W
-    im = im.transpose((2,0,1))
-    datum = caffe.io.array_to_datum(im, label)
-    datum = datum.SerializeToString()
-    return datum
+    return np.array(im)
+
+'''
+@brief:
+    get serialized datum of image-label pair, used solely for caffe
+@input:
+    img_label - (img_filename, label) or (img_filename, label, label_vector)
+@output:
+    serialized datum of resized,colored,channel-swapped,transposed image
+'''
+def imglabel2datum(img_label):
+    imname, label = img_label[0:2]
+    label_vector = img_label[2] if len(img_label) > 2 else None
+    return imarray2datum(load_resized_image(imname), label, label_vector)
+
+'''
+@brief:
+    get serialized datum of a vector (e.g. a label), used solely for caffe
+@input:
+    vector - list of values
+    label - datum label
+'''
+def vector2datum(vector, label):
+    datum = np.array(vector, dtype=np.float64)
+    datum = np.reshape(datum, [len(datum),1,1])
+    datum = caffe.io.array_to_datum(datum, label)
+    return datum.SerializeToString()
+
+'''
+@brief:
+    key of the last entry of an LMDB, None if it is empty
+'''
+def last_lmdb_key(in_db):
+    with in_db.begin(write=False) as in_txn:
+        cursor = in_txn.cursor()
+        if not cursor.last():
+            return None
+        return cursor.key()
+
+'''
+@brief:
+    md5 of the lines an LMDB is written from
+'''
+def lines_fingerprint(lines):
+    return hashlib.md5('\n'.join(lines)).hexdigest()
+
+'''
+@brief:
+    the fingerprint (see lines_fingerprint) of the list an LMDB is written from is saved in
+    <output_lmdb>/list_md5.txt, so that a partially written LMDB is only resumed from the same list
+@output:
+    number of entries already in the LMDB, RuntimeError if it has entries written from another list
+'''
+def check_lmdb_fingerprint(in_db, output_lmdb, fingerprint):
+    fingerprint_file = os.path.join(output_lmdb, 'list_md5.txt')
+    entries = in_db.stat()['entries']
+    if entries == 0:
+        with open(fingerprint_file, 'w') as fout:
+            fout.write('%s\n' % (fingerprint))
+        return entries
+    stored_fingerprint = open(fingerprint_file, 'r').read().strip() if os.path.exists(fingerprint_file) else None
+    if stored_fingerprint != fingerprint:
+        raise RuntimeError('%s has %d entries written from a different list, remove it to write it again' % (output_lmdb, entries))
+    return entries
 
 '''
 @brief:
     Image LMDB writing with parallal data serialization (which takes most time).
+    workers serialize images in order (Pool.imap) while the datums are written, and the write
+    transaction is committed every batch_N images, so a crashed run loses at most one batch.
+    a partially written LMDB is resumed after its last key, if it was written from the same lines
+    of image_file (and label_vectors), see check_lmdb_fingerprint.
 @input:
     image_file - txt file each line of which is image filename
     output_lmdb - lmdb pathname
+    batch_N - number of images per write transaction
+    worker_num - number of serialization processes, images are serialized in this process if <= 1
+    begin, end - only lines [begin, end) of image_file are written (a shard, see write_sharded_lmdbs)
+    label_vectors - label of each line of image_file, stored in the image datums (optional, see
+                    CombinedLMDBReader)
 @output:
     generate image LMDB (label is just idx of image in the image_file)
-    labels should be separately prepared
-    note: lmdb key is idx number (e.g. 0000000021) of image in image_file
+    labels should be separately prepared, unless label_vectors is given
+    note: lmdb key is idx number (e.g. 0000000021) of image in image_file, minus begin
 '''
-def write_image_lmdb(image_file, output_lmdb):
-    img_filenames = [line.rstrip().split(' ')[0] for line in open(image_file, 'r')]
+def write_image_lmdb(image_file, output_lmdb, batch_N=g_lmdb_commit_batch_size, worker_num=g_lmdb_writer_worker_num, begin=0, end=None, label_vectors=None):
+    lines = [line.rstrip() for line in open(image_file, 'r')][begin:end]
+    img_filenames = [line.split(' ')[0] for line in lines]
     N = len(img_filenames)
-    
-    p = Pool(20)
-    batch_N = 1000
-    
+    if label_vectors is not None:
+        label_vectors = label_vectors[begin:end]
+        lines = lines + [' '.join([str(x) for x in label_vector]) for label_vector in label_vectors]
+
     in_db = lmdb.open(output_lmdb, map_size=int(1e12))
-    with in_db.begin(write=True) as in_txn:
-        for in_idx in range(N):
-            if (in_idx % batch_N) == 0:
-                print('[%s]: %d/%d' % (datetime.datetime.now(), in_idx, N))
-                batch_ims = [(img_filenames[k+in_idx], k+in_idx) \
-                             for k in range(min(batch_N, N-in_idx))]
-                batch_datums = p.map(imglabel2datum, batch_ims)
-            in_txn.put('{:0>10d}'.format(in_idx), batch_datums[in_idx % batch_N])
-    in_db.close()
+    try:
+        check_lmdb_fingerprint(in_db, output_lmdb, lines_fingerprint(lines))
+    except:
+        in_db.close()
+        raise
+    last_key = last_lmdb_key(in_db)
+    start_idx = 0 if last_key is None else int(last_key) + 1
+    if start_idx >= N:
+        print('%s: all %d images already written' % (output_lmdb, N))
+        in_db.close()
+        return
+    if start_idx > 0:
+        print('%s: resuming after key %s' % (output_lmdb, last_key))
+
+    if label_vectors is None:
+        batch_ims = ((img_filenames[k], begin+k) for k in range(start_idx, N))
+    else:
+        batch_ims = ((img_filenames[k], begin+k, label_vectors[k]) for k in range(start_idx, N))
+    if worker_num > 1:
+        p = Pool(worker_num)
+        datums = p.imap(imglabel2datum, batch_ims, chunksize=16)
+    else:
+        p = None
+        datums = (imglabel2datum(img_label) for img_label in batch_ims)
+    start_time = datetime.datetime.now()
+    in_txn = in_db.begin(write=True)
+    try:
+        for in_idx, datum in enumerate(datums, start_idx):
+            in_txn.put('{:0>10d}'.format(in_idx), datum)
+            if (in_idx + 1) % batch_N == 0 or in_idx + 1 == N:
+                in_txn.commit()
+                in_txn = in_db.begin(write=True)
+                seconds = (datetime.datetime.now() - start_time).total_seconds()
+                print('[%s]: %d/%d, %.1f images/sec' % (datetime.datetime.now(), in_idx + 1, N, (in_idx + 1 - start_idx) / max(seconds, 1e-6)))
+    finally:
+        in_txn.abort()
+        if p is not None:
+            p.terminate()
+            p.join()
+        in_db.close()
+
+'''
+@brief:
+    reader of an LMDB of image datums that also hold their labels (written by write_image_lmdb
+    with label_vectors), one lookup per sample instead of one in the image and one in the label LMDB
+'''
+class CombinedLMDBReader(object):
+    def __init__(self, dbname):
+        self.db = lmdb.open(dbname, map_size=int(1e12), readonly=True, lock=False)
+        self.txn = self.db.begin(write=False)
+
+    def __len__(self):
+        return self.db.stat()['entries']
+
+    '''
+    @output:
+        (CxHxW uint8 BGR image, float32 label vector) of sample idx
+    '''
+    def get(self, idx):
+        serialized_datum = self.txn.get('{:0>10d}'.format(idx))
+        if serialized_datum is None:
+            raise KeyError(idx)
+        return datum2imglabel(serialized_datum)
+
+    '''
+    @output:
+        (idx, image, label vector) of all samples in key order
+    '''
+    def __iter__(self):
+        for key, serialized_datum in self.txn.cursor():
+            im, label_vector = datum2imglabel(serialized_datum)
+            yield (int(key), im, label_vector)
+
+    def close(self):
+        self.txn.abort()
+        self.db.close()
 
 '''
 @brief:
@@ -83,51 +269,205 @@ def write_image_lmdb(image_file, output_lmdb):
     output_lmdb - lmdb pathname
 @output:
     generate vector LMDB (can be used as labels)
-    note: lmdb key is idx number (e.g. 0000000021) of image in image_file
+    note: lmdb key is idx number (e.g. 0000000021) of image in image_file, minus begin
+    (only lines [begin, end) are written, see write_image_lmdb)
+    an LMDB already written from the same lines is kept (it is written in one transaction)
 '''
-def write_vector_lmdb(input_txt_file, output_lmdb):
-    lines = [line.rstrip() for line in open(input_txt_file, 'r')]
+def write_vector_lmdb(input_txt_file, output_lmdb, begin=0, end=None):
+    lines = [line.rstrip() for line in open(input_txt_file, 'r')][begin:end]
     N = len(lines)
     
     in_db = lmdb.open(output_lmdb, map_size=int(1e12))
+    try:
+        entries = check_lmdb_fingerprint(in_db, output_lmdb, lines_fingerprint(lines))
+    except:
+        in_db.close()
+        raise
+    if entries > 0:
+        print('%s: all %d vectors already written' % (output_lmdb, N))
+        in_db.close()
+        return
     report_N = 1000
     with in_db.begin(write=True) as in_txn:
         for in_idx in range(N):
             if (in_idx%report_N) == 0:
                 print('[%s]: %d/%d' % (datetime.datetime.now(), in_idx, N))
             ll = lines[in_idx].split(' ')
-            datum = np.array([float(x) for x in ll])
-            datum = np.reshape(datum, [len(datum),1,1])
-            datum = caffe.io.array_to_datum(datum, in_idx)
-            in_txn.put('{:0>10d}'.format(in_idx), datum.SerializeToString())
+            in_txn.put('{:0>10d}'.format(in_idx), vector2datum([float(x) for x in ll], begin+in_idx))
     in_db.close()
 
+'''
+@brief:
+    write the image and label LMDBs of one shard, run by write_sharded_lmdbs in its own process.
+    like write_image_lmdb and write_vector_lmdb, a shard is resumed (or kept) only if it was
+    written from the same lines, otherwise the process fails
+'''
+def write_lmdb_shard(image_file, label_file, image_lmdb, label_lmdb, begin, end):
+    write_vector_lmdb(label_file, label_lmdb, begin, end)
+    write_image_lmdb(image_file, image_lmdb, worker_num=1, begin=begin, end=end)
+
+'''
+@brief:
+    image and label LMDBs written as shard_num shards of consecutive lines, one writer process
+    per shard, all shards at the same time.
+@input:
+    image_file - txt file each line of which is image filename
+    label_file - txt file each line is label values separated by space (see write_vector_lmdb)
+    image_lmdb, label_lmdb - lmdb pathnames, shard k is written to <pathname>_<k:03d>
+    index_file - index of the shards written there (see read_lmdb_index)
+@output:
+    index of the shards, list of (begin, end, image shard lmdb, label shard lmdb): lines [begin, end)
+    are in the shard, with keys idx-begin
+'''
+def write_sharded_lmdbs(image_file, label_file, image_lmdb, label_lmdb, shard_num, index_file):
+    N = len(open(image_file, 'r').readlines())
+    index = []
+    for k in range(shard_num):
+        index.append((N*k//shard_num, N*(k+1)//shard_num, '%s_%03d' % (image_lmdb, k), '%s_%03d' % (label_lmdb, k)))
+
+    processes = [Process(target=write_lmdb_shard, args=(image_file, label_file, shard_image_lmdb, shard_label_lmdb, begin, end)) \
+                 for begin, end, shard_image_lmdb, shard_label_lmdb in index]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed_shards = [shard_idx for shard_idx, process in enumerate(processes) if process.exitcode != 0]
+    if len(failed_shards) > 0:
+        raise RuntimeError('Failed to write LMDB shards %s, rerun with the same lists and shard_num to resume them '
+                           '(shards written from other lists are not resumed, remove them to write them again)' % (failed_shards))
+
+    with open(index_file, 'w') as fout:
+        for begin, end, shard_image_lmdb, shard_label_lmdb in index:
+            fout.write('%d %d %s %s\n' % (begin, end, shard_image_lmdb, shard_label_lmdb))
+    return index
+
+'''
+@brief:
+    index of LMDB shards written by write_sharded_lmdbs
+'''
+def read_lmdb_index(index_file):
+    index = []
+    for line in open(index_file, 'r'):
+        ll = line.rstrip().split(' ')
+        index.append((int(ll[0]), int(ll[1]), ll[2], ll[3]))
+    return index
+
+'''
+@brief:
+    shard of a global key
+@input:
+    index - see write_sharded_lmdbs
+    key - global lmdb key (e.g. 0000000021)
+@output:
+    (shard idx, key in the shard lmdbs)
+'''
+def lookup_lmdb_index(index, key):
+    idx = int(key)
+    shard_idx = bisect.bisect_right([begin for begin, _, _, _ in index], idx) - 1
+    begin, end = index[shard_idx][0:2]
+    if shard_idx < 0 or idx >= end:
+        raise KeyError(key)
+    return (shard_idx, '{:0>10d}'.format(idx - begin))
+
+'''
+@brief:
+    merge LMDB shards into one LMDB with global keys, in key order. a partially merged LMDB is
+    resumed after its last key, if it was merged from shards of the same lists (see
+    check_lmdb_fingerprint).
+@input:
+    shard_lmdbs - lmdb pathnames of the shards
+    begins - global idx of the first entry of each shard
+'''
+def merge_lmdb_shards(shard_lmdbs, begins, output_lmdb, batch_N=g_lmdb_commit_batch_size):
+    shard_fingerprints = [open(os.path.join(shard_lmdb, 'list_md5.txt'), 'r').read().strip() for shard_lmdb in shard_lmdbs]
+    out_db = lmdb.open(output_lmdb, map_size=int(1e12))
+    try:
+        check_lmdb_fingerprint(out_db, output_lmdb, lines_fingerprint(['%d %s' % x for x in zip(begins, shard_fingerprints)]))
+    except:
+        out_db.close()
+        raise
+    last_key = last_lmdb_key(out_db)
+    next_idx = 0 if last_key is None else int(last_key) + 1
+    out_txn = out_db.begin(write=True)
+    put_num = 0
+    try:
+        for shard_lmdb, begin in zip(shard_lmdbs, begins):
+            print('[%s]: merging %s' % (datetime.datetime.now(), shard_lmdb))
+            in_db = lmdb.open(shard_lmdb, map_size=int(1e12), readonly=True)
+            with in_db.begin(write=False) as in_txn:
+                for key, value in in_txn.cursor():
+                    idx = begin + int(key)
+                    if idx < next_idx:
+                        continue
+                    out_txn.put('{:0>10d}'.format(idx), value, append=True)
+                    put_num += 1
+                    if put_num % batch_N == 0:
+                        out_txn.commit()
+                        out_txn = out_db.begin(write=True)
+            in_db.close()
+        out_txn.commit()
+        out_txn = out_db.begin(write=True)
+    finally:
+        out_txn.abort()
+        out_db.close()
+
+
+# LMDB stat fields saved with a vector cache, the cache is used only if they all match
+lmdb_cache_stat_keys = ['entries', 'psize', 'depth', 'branch_pages', 'leaf_pages', 'overflow_pages']
 
 '''
 @brief:
     Load vectors from LMDB, return the vectors as NxD numpy array
+    the datums are read in key order with a cursor and parsed into a preallocated float32 array
+@input:
+    cache_file - optional .npy file, the array is saved there (with the LMDB stat in
+                 <cache_file>.stat.txt) and later loads memory-map it instead of reading the LMDB,
+                 as long as the stat of the LMDB, N and feat_dim are unchanged
+@output:
+    NxD float32 array (read-only memory map if cache_file is given)
 '''
-def load_vector_from_lmdb(dbname, feat_dim, max_num=float('Inf')):
-    in_db = lmdb.open(dbname, map_size=int(1e12))
-    print dbname, in_db.stat()
+def load_vector_from_lmdb(dbname, feat_dim, max_num=float('Inf'), cache_file=None):
+    in_db = lmdb.open(dbname, map_size=int(1e12), readonly=True, lock=False)
+    stat = in_db.stat()
+    print('%s: %s' % (dbname, stat))
+    N = int(min(stat['entries'], max_num))
+    feat_dim = int(feat_dim)
+    cache_stat = ['%s %d' % (key, stat[key]) for key in lmdb_cache_stat_keys] + ['N %d' % (N), 'feat_dim %d' % (feat_dim)]
 
-    N = min(in_db.stat()['entries'], max_num) 
-    feats = np.zeros((N,int(feat_dim)))
-    
+    if cache_file is not None and os.path.exists(cache_file) and os.path.exists(cache_file + '.stat.txt'):
+        if [line.rstrip() for line in open(cache_file + '.stat.txt', 'r')] == cache_stat:
+            in_db.close()
+            print('Loading cached vectors from %s' % (cache_file))
+            return np.load(cache_file, mmap_mode='r')
+        print('%s is outdated, reading %s' % (cache_file, dbname))
+
+    feats = np.empty((N, feat_dim), dtype=np.float32)
+    datum = caffe_pb2.Datum()
+    k = 0
     with in_db.begin(write=False) as in_txn:
-        for k in range(N):
-            print k
-            keyname = '%010d' % k
-            a = in_txn.get(keyname)
-            datum = caffe_pb2.Datum()
-            datum.ParseFromString(a)
-            array =  caffe.io.datum_to_array(datum)
-            #print array, np.shape(array)
-            array = np.squeeze(array)
-            assert(array is not None)
-            feats[k,:] = array
+        for key, value in in_txn.cursor():
+            if k >= N:
+                break
+            if int(key) != k:
+                raise ValueError('%s: expected key %010d, got %s' % (dbname, k, key))
+            datum.ParseFromString(value)
+            feats[k,:] = datum.float_data if len(datum.float_data) > 0 else np.frombuffer(datum.data, dtype=np.uint8)
+            k += 1
+            if k % 100000 == 0:
+                print('[%s]: %d/%d' % (datetime.datetime.now(), k, N))
     in_db.close()
-    return feats
+    assert(k == N)
+
+    if cache_file is None:
+        return feats
+    tmp_cache_file = '%s.%d.tmp.npy' % (os.path.splitext(cache_file)[0], os.getpid())
+    np.save(tmp_cache_file, feats)
+    if os.path.exists(cache_file + '.stat.txt'):
+        os.remove(cache_file + '.stat.txt')
+    os.rename(tmp_cache_file, cache_file)
+    with open(cache_file + '.stat.txt', 'w') as fout:
+        fout.write('\n'.join(cache_stat) + '\n')
+    return np.load(cache_file, mmap_mode='r')
 
 '''
 @brief:
@@ -57,7 +57,8 @@ def get_one_category_image_label_file(shape_synset, train_image_label_file, test
         image_filename_label_pairs = [(fpath,path2label(fpath)) for fpath in image_filenames]
         random.shuffle(image_filename_label_pairs)
 
-        fout = open(image_label_file, 'w')
+        # written through a temporary file, an existing list is always complete
+        fout = open(image_label_file+'.tmp', 'w')
         for filename_label in image_filename_label_pairs:
             label = filename_label[1]
 	    if ignore_angle:
@@ -65,6 +66,7 @@ def get_one_category_image_label_file(shape_synset, train_image_label_file, test
             else:
                 fout.write('%s %d %d %d %d\n' % (filename_label[0], class_idx, label[0], label[1], label[2]))
         fout.close()
+        os.rename(image_label_file+'.tmp', image_label_file)
 
 
 '''
@@ -82,10 +84,11 @@ def combine_files(input_file_list, output_file, shuffle=1):
 
     if shuffle: random.shuffle(all_lines)
 
-    fout = open(output_file,'w')
+    fout = open(output_file+'.tmp','w')
     for line in all_lines:
         fout.write('%s\n' % (line))
     fout.close()
+    os.rename(output_file+'.tmp', output_file)
 
 '''
 @brief:
@@ -103,30 +106,54 @@ def view2label(degree, class_index):
     image_label_file - each line is <image_filepath> <class_idx> <azimuth> <elelvation> <tilt>
     output_lmdb: LMDB pathname-prefix like xxx/xxxx_lmdb
     image_resize_dim (D): resize image to DxD square
+    shard_num: if > 1, LMDBs are written as shard_num shards in parallel (see write_sharded_lmdbs),
+               xxx/xxxx_lmdb_image_000, xxx/xxxx_lmdb_label_000, ... indexed by xxx/xxxx_lmdb_index.txt
+    merge_shards: merge the shards into the two LMDBs below afterwards
+    combined: write ONE LMDB xxx/xxxx_lmdb_combined instead, each item holds both the image and
+              its label (see imglabel2datum and CombinedLMDBReader), shard_num is not used
 @output:
     write TWO LMDB corresponding to images and labels, 
     i.e. xxx/xxxx_lmdb_label (each item is class_idx, azimuth, elevation, tilt) and xxx/xxxx_lmdb_image
 '''
-def generate_image_view_lmdb(image_label_file, output_lmdb, ignore_angle=False):
+def generate_image_view_lmdb(image_label_file, output_lmdb, ignore_angle=False, shard_num=g_lmdb_shard_num, merge_shards=g_lmdb_merge_shards, combined=g_lmdb_combined_records):
     lines = [line.rstrip() for line in open(image_label_file,'r')]
 
-    tmp_label_fout = tempfile.NamedTemporaryFile(dir=g_syn_images_lmdb_folder, delete=False)
+    label_vectors = []
     for line in lines:
         ll = line.split(' ')
-	if ignore_angle:
-	    class_idx = int(ll[1])
-	    tmp_label_fout.write('%d\n' % (class_idx))
+        if ignore_angle:
+            label_vectors.append([int(ll[1])])
         else:
-	    class_idx, azimuth, elevation, tilt = [int(x) for x in ll[1:]]
-	    tmp_label_fout.write('%d %d %d %d\n' % (class_idx, view2label(azimuth, class_idx), view2label(elevation, class_idx), view2label(tilt, class_idx)))
+            class_idx, azimuth, elevation, tilt = [int(x) for x in ll[1:]]
+            label_vectors.append([class_idx, view2label(azimuth, class_idx), view2label(elevation, class_idx), view2label(tilt, class_idx)])
+
+    if combined:
+        # resumes a partially written LMDB of the same image_label_file
+        write_image_lmdb(image_label_file, output_lmdb+'_combined', label_vectors=label_vectors)
+        print "Combined DB done ..."
+        return
+
+    tmp_label_fout = tempfile.NamedTemporaryFile(dir=g_syn_images_lmdb_folder, delete=False)
+    for label_vector in label_vectors:
+        tmp_label_fout.write('%s\n' % (' '.join(['%d' % (x) for x in label_vector])))
     tmp_label_fout.close()
     print("Tmp label file generated: %s" % tmp_label_fout.name)
-    
-    if not os.path.exists(output_lmdb+'_label'):
-        write_vector_lmdb(tmp_label_fout.name, output_lmdb+'_label')
+
+    if shard_num > 1:
+        index = write_sharded_lmdbs(image_label_file, tmp_label_fout.name, output_lmdb+'_image', output_lmdb+'_label', shard_num, output_lmdb+'_index.txt')
+        print "LMDB shards done ..."
+        if merge_shards:
+            begins = [begin for begin, _, _, _ in index]
+            merge_lmdb_shards([shard_label_lmdb for _, _, _, shard_label_lmdb in index], begins, output_lmdb+'_label')
+            merge_lmdb_shards([shard_image_lmdb for _, _, shard_image_lmdb, _ in index], begins, output_lmdb+'_image')
+            print "LMDB shards merged ..."
+        os.system('rm %s' % (tmp_label_fout.name))
+        return
+
+    # both are kept or resumed only if they were written from the same image_label_file
+    write_vector_lmdb(tmp_label_fout.name, output_lmdb+'_label')
     print "Label DB done ..."
-    if not os.path.exists(output_lmdb+'_image'):
-        write_image_lmdb(image_label_file, output_lmdb+'_image')  
+    write_image_lmdb(image_label_file, output_lmdb+'_image')
     print "Image DB done ..."
     
     # clean up
@@ -28,16 +28,20 @@ if __name__ == '__main__':
     if not os.path.exists(g_syn_images_lmdb_folder):
         os.mkdir(g_syn_images_lmdb_folder)
 
-    # get image filenames and labels, separated to train/test sets
+    # get image filenames and labels, separated to train/test sets. the (shuffled) lists of an
+    # earlier run are reused, so that its LMDBs can be resumed; remove them to shuffle again
     for idx, synset in enumerate(g_shape_synsets):
         name = g_shape_names[idx]
+        if os.path.exists(os.path.join(g_syn_images_lmdb_folder, name+'_train.txt')) and os.path.exists(os.path.join(g_syn_images_lmdb_folder, name+'_test.txt')):
+            continue
         get_one_category_image_label_file(synset, os.path.join(g_syn_images_lmdb_folder, name+'_train.txt'), os.path.join(g_syn_images_lmdb_folder, name+'_test.txt'), ignore_angle=True)
 
     for keyword in ['train', 'test']:
         # combine filenames&labels from all 12 classes (shuffled)
         input_file_list = [os.path.join(g_syn_images_lmdb_folder, '%s_%s.txt' % (name, keyword)) for name in g_shape_names]
         output_file = os.path.join(g_syn_images_lmdb_folder, 'all_%s.txt' % (keyword))
-        combine_files(input_file_list, output_file)
+        if not os.path.exists(output_file):
+            combine_files(input_file_list, output_file)
         
         # generate LMDB
         generate_image_view_lmdb(output_file, '%s_%s' % (g_syn_images_lmdb_pathname_prefix, keyword), ignore_angle=True)